@@ -3,15 +3,25 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from datetime import datetime
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
+from flask_migrate import Migrate
+from sqlalchemy import func, and_, case
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 from flask_wtf import Form
 from forms import *
+from search import NameSearch, enable_pg_trgm
+from dates import DateFormatter
+from fragments import FragmentCache, FragmentCacheExtension
+from pagination import page_from_request
+from logging_pipeline import setup_logging
+import click
+import seeding
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -20,15 +30,39 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db = SQLAlchemy(app)
-
-# TODO: connect to a local postgresql database
+migrate = Migrate(app, db)
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+# genre_id leads the primary keys so "venues/artists with genre X" is a
+# range scan of the association table
+venue_genres = db.Table('venue_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genres_venue_id', 'venue_id'),
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genres_artist_id', 'artist_id'),
+)
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_venue_city_state', 'city', 'state'),
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -38,36 +72,333 @@ class Venue(db.Model):
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    genres = db.relationship('Genre', secondary=venue_genres, order_by=Genre.name)
+
+    # every UPDATE checks and increments version_id (optimistic locking)
+    __mapper_args__ = {'version_id_col': version_id}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artist_name_id', 'name', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    genres = db.relationship('Genre', secondary=artist_genres, order_by=Genre.name)
+
+    __mapper_args__ = {'version_id_col': version_id}
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+class Show(db.Model):
+    __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+
+    # dynamic backrefs: venue.shows / artist.shows are queries, never lists
+    # loaded one show at a time
+    venue = db.relationship('Venue', backref=db.backref('shows', lazy='dynamic'))
+    artist = db.relationship('Artist', backref=db.backref('shows', lazy='dynamic'))
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+enable_pg_trgm(db.metadata)
+venue_search = NameSearch(db, Venue, Show, Show.venue_id)
+artist_search = NameSearch(db, Artist, Show, Show.artist_id)
+
+fragment_cache = FragmentCache(max_size=app.config['FRAGMENT_CACHE_SIZE'],
+                               ttl=app.config['FRAGMENT_CACHE_TTL'])
+fragment_cache.watch(Venue)
+fragment_cache.watch(Artist)
+fragment_cache.watch(Show, ('Venue', 'venue_id'), ('Artist', 'artist_id'))
+fragment_cache.watch_session(db.session)
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragment_cache
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def venue_areas(now=None):
+  '''
+  Venues grouped by city/state, each with its number of upcoming shows.
+  A single aggregate query: venues are left-joined to their future shows
+  only, so the count is read straight off the (venue_id, start_time) index.
+  Rows are streamed from the cursor and grouped on the fly.
+  '''
+  now = now or datetime.now()
+  rows = db.session.query(
+      Venue.city, Venue.state, Venue.id, Venue.name,
+      func.count(Show.id).label('num_upcoming_shows')
+    ).outerjoin(Show, and_(Show.venue_id == Venue.id, Show.start_time > now)
+    ).group_by(Venue.city, Venue.state, Venue.id, Venue.name
+    ).order_by(Venue.city, Venue.state, Venue.name
+    ).yield_per(1000)
+
+  for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+    yield {
+      "city": city,
+      "state": state,
+      "venues": ({
+        "id": venue.id,
+        "name": venue.name,
+        "num_upcoming_shows": venue.num_upcoming_shows,
+      } for venue in venues)
+    }
+
+SHOWS_PER_SECTION = 50
+
+def with_show_counts(model, show_fk, id, now):
+  '''
+  The `model` row with the given id plus its upcoming and past show counts,
+  in one query that reads the (fk, start_time) index. None if there is no
+  such row.
+  '''
+  return db.session.query(
+      model,
+      func.count(case([(Show.start_time > now, Show.id)])).label('upcoming_shows_count'),
+      func.count(case([(Show.start_time <= now, Show.id)])).label('past_shows_count')
+    ).outerjoin(Show, show_fk == model.id
+    ).filter(model.id == id
+    ).group_by(model.id
+    ).one_or_none()
+
+def show_section(show_fk, id, other, other_fk, prefix, upcoming, now, limit=SHOWS_PER_SECTION):
+  '''
+  Upcoming (soonest first) or past (latest first) shows for one venue or
+  artist, joined to the other side of the show (`other`) in the same query
+  and capped at `limit` rows. Keys are prefixed with `prefix` ('artist'
+  on a venue page, 'venue' on an artist page) as the templates expect.
+  Nothing is queried until the result is iterated, so a page whose
+  fragment is cached never runs it.
+  '''
+  if upcoming:
+    when, order = Show.start_time > now, Show.start_time.asc()
+  else:
+    when, order = Show.start_time <= now, Show.start_time.desc()
+  rows = db.session.query(
+      Show.start_time, other.id, other.name, other.image_link
+    ).join(other, other_fk == other.id
+    ).filter(show_fk == id, when
+    ).order_by(order
+    ).limit(limit)
+  for row in rows:
+    yield {
+      prefix + "_id": row.id,
+      prefix + "_name": row.name,
+      prefix + "_image_link": row.image_link,
+      "start_time": row.start_time,
+    }
+
+def genre_names(obj):
+  '''The names of obj.genres, loaded when first iterated (see show_section).'''
+  for genre in obj.genres:
+    yield genre.name
+
+def venue_detail(venue_id, now=None):
+  '''show_venue data in four queries: the venue with its counts, its genres, then (lazily) each show list.'''
+  now = now or datetime.now()
+  row = with_show_counts(Venue, Show.venue_id, venue_id, now)
+  if row is None:
+    return None
+  venue = row.Venue
+  return {
+    "id": venue.id,
+    "name": venue.name,
+    "genres": genre_names(venue),
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "facebook_link": venue.facebook_link,
+    "image_link": venue.image_link,
+    "past_shows": show_section(Show.venue_id, venue_id, Artist, Show.artist_id, 'artist', False, now),
+    "upcoming_shows": show_section(Show.venue_id, venue_id, Artist, Show.artist_id, 'artist', True, now),
+    "past_shows_count": row.past_shows_count,
+    "upcoming_shows_count": row.upcoming_shows_count,
+  }
+
+def artist_detail(artist_id, now=None):
+  '''show_artist data in four queries: the artist with its counts, its genres, then (lazily) each show list.'''
+  now = now or datetime.now()
+  row = with_show_counts(Artist, Show.artist_id, artist_id, now)
+  if row is None:
+    return None
+  artist = row.Artist
+  return {
+    "id": artist.id,
+    "name": artist.name,
+    "genres": genre_names(artist),
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "facebook_link": artist.facebook_link,
+    "image_link": artist.image_link,
+    "past_shows": show_section(Show.artist_id, artist_id, Venue, Show.venue_id, 'venue', False, now),
+    "upcoming_shows": show_section(Show.artist_id, artist_id, Venue, Show.venue_id, 'venue', True, now),
+    "past_shows_count": row.past_shows_count,
+    "upcoming_shows_count": row.upcoming_shows_count,
+  }
+
+def paginated(query, columns, format=None):
+  '''The page of `query` (keyset-ordered on `columns`) asked for in the query string.'''
+  try:
+    return page_from_request(request.args, query, columns, app.config['PAGE_SIZE'],
+                             app.config['MAX_PAGE_SIZE'], format=format)
+  except ValueError:
+    abort(400)
+
+def artists_page():
+  return paginated(db.session.query(Artist.id, Artist.name), (Artist.name, Artist.id),
+                   format=lambda row: {"id": row.id, "name": row.name})
+
+def shows_page():
+  '''Every show in start time order, with its venue and artist joined in.'''
+  query = db.session.query(
+      Show.id, Show.start_time,
+      Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+      Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ).join(Venue, Show.venue_id == Venue.id
+    ).join(Artist, Show.artist_id == Artist.id)
+  return paginated(query, (Show.start_time, Show.id), format=lambda row: {
+    "venue_id": row.venue_id,
+    "venue_name": row.venue_name,
+    "artist_id": row.artist_id,
+    "artist_name": row.artist_name,
+    "artist_image_link": row.artist_image_link,
+    "start_time": row.start_time,
+  })
+
+def genre_filter_page(model, association, fk):
+  '''
+  Venues or artists with the `genre` and in the `city`/`state` given in the
+  query string, any of which may be left out. Pages are keyed on id; with
+  a genre it is the association table's id, so the rows come straight off
+  its (genre_id, <fk>) primary key in order, with no sort.
+  '''
+  genre = request.args.get('genre')
+  key = association.c[fk] if genre else model.id
+  query = db.session.query(key, model.name, model.city, model.state)
+  if genre:
+    query = query.select_from(association
+      ).join(model, model.id == key
+      ).join(Genre, Genre.id == association.c.genre_id
+      ).filter(Genre.name == genre)
+  for field in ('city', 'state'):
+    if request.args.get(field):
+      query = query.filter(getattr(model, field) == request.args[field])
+  return paginated(query, (key,), format=lambda row: {
+    "id": row[0],
+    "name": row.name,
+    "city": row.city,
+    "state": row.state,
+  })
+
+def stream_template(template_name, **context):
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(5)
+  return Response(stream_with_context(stream))
+
+#----------------------------------------------------------------------------#
+# Writes.
+#----------------------------------------------------------------------------#
+
+VENUE_FIELDS = ('name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link')
+ARTIST_FIELDS = ('name', 'city', 'state', 'phone', 'image_link', 'facebook_link')
+
+class EditConflict(Exception):
+  '''The row was changed by another submission after the form was loaded.'''
+
+def genres_named(names):
+  '''The Genre rows for `names`, creating any that don't exist yet.'''
+  names = sorted({name.strip() for name in names if name.strip()})
+  if not names:
+    return []
+  genres = Genre.query.filter(Genre.name.in_(names)).all()
+  known = {genre.name for genre in genres}
+  return genres + [Genre(name=name) for name in names if name not in known]
+
+def form_values(form, fields):
+  values = {field: form[field] for field in fields if field in form}
+  if 'genres' in form:
+    values['genres'] = genres_named(form.getlist('genres'))
+  return values
+
+def venue_values(form):
+  return form_values(form, VENUE_FIELDS)
+
+def artist_values(form):
+  return form_values(form, ARTIST_FIELDS)
+
+def create(model, values):
+  '''Insert one row in its own transaction.'''
+  try:
+    obj = model(**values)
+    db.session.add(obj)
+    db.session.commit()
+    return obj
+  except Exception:
+    db.session.rollback()
+    raise
+
+def update(model, id, version, values):
+  '''
+  Apply `values` to the row in one transaction, provided it is still at
+  `version`, the version its edit form was loaded at. A stale form is
+  caught by the comparison; an edit committed between our read and our
+  write is caught by the UPDATE's `WHERE version_id = :loaded`, which then
+  matches no row and raises StaleDataError. Either way EditConflict is
+  raised and nothing is written. Returns None if the row doesn't exist.
+  '''
+  try:
+    obj = model.query.get(id)
+    if obj is None:
+      return None
+    if obj.version_id != version:
+      raise EditConflict()
+    for key, value in values.items():
+      setattr(obj, key, value)
+    if db.session.is_modified(obj):
+      # a change to genres alone only touches the association table; mark
+      # the row itself dirty so that its UPDATE checks and bumps the version
+      flag_modified(obj, 'name')
+    db.session.commit()
+    return obj
+  except StaleDataError:
+    db.session.rollback()
+    raise EditConflict()
+  except Exception:
+    db.session.rollback()
+    raise
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+format_datetime = DateFormatter(locale='en')
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -85,130 +416,33 @@ def index():
 
 @app.route('/venues')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "city": "San Francisco",
-    "state": "CA",
-    "venues": [{
-      "id": 1,
-      "name": "The Musical Hop",
-      "num_upcoming_shows": 0,
-    }, {
-      "id": 3,
-      "name": "Park Square Live Music & Coffee",
-      "num_upcoming_shows": 1,
-    }]
-  }, {
-    "city": "New York",
-    "state": "NY",
-    "venues": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }]
-  return render_template('pages/venues.html', areas=data);
+  return stream_template('pages/venues.html', areas=venue_areas())
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response={
-    "count": 1,
-    "data": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  response = venue_search.search(request.form.get('search_term', ''),
+                                 request.form.get('limit', type=int))
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  data1={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-    "past_shows": [{
-      "artist_id": 4,
-      "artist_name": "Guns N Petals",
-      "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data2={
-    "id": 2,
-    "name": "The Dueling Pianos Bar",
-    "genres": ["Classical", "R&B", "Hip-Hop"],
-    "address": "335 Delancey Street",
-    "city": "New York",
-    "state": "NY",
-    "phone": "914-003-1132",
-    "website": "https://www.theduelingpianos.com",
-    "facebook_link": "https://www.facebook.com/theduelingpianos",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1497032205916-ac775f0649ae?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=750&q=80",
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 0,
-  }
-  data3={
-    "id": 3,
-    "name": "Park Square Live Music & Coffee",
-    "genres": ["Rock n Roll", "Jazz", "Classical", "Folk"],
-    "address": "34 Whiskey Moore Ave",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "415-000-1234",
-    "website": "https://www.parksquarelivemusicandcoffee.com",
-    "facebook_link": "https://www.facebook.com/ParkSquareLiveMusicAndCoffee",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-    "past_shows": [{
-      "artist_id": 5,
-      "artist_name": "Matt Quevedo",
-      "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [{
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 1,
-  }
-  data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
+  data = venue_detail(venue_id)
+  if data is None:
+    abort(404)
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/autocomplete')
+def autocomplete_venues():
+  return jsonify(venue_search.autocomplete(request.args.get('q', ''),
+                                           request.args.get('limit', 10, type=int)))
+
+@app.route('/venues/filter')
+def filter_venues():
+  # e.g. /venues/filter?genre=Jazz&state=CA
+  page = genre_filter_page(Venue, venue_genres, 'venue_id')
+  return jsonify({"data": page.items, "next": page.next})
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -219,14 +453,13 @@ def create_venue_form():
 
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
-  # TODO: insert form data as a new Venue record in the db, instead
-  # TODO: modify data to be the data object returned from db insertion
-
-  # on successful db insert, flash success
+  try:
+    create(Venue, venue_values(request.form))
+  except SQLAlchemyError:
+    app.logger.exception('creating venue failed')
+    flash('An error occurred. Venue ' + request.form.get('name', '') + ' could not be listed.')
+    return render_template('pages/home.html'), 500
   flash('Venue ' + request.form['name'] + ' was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
@@ -242,164 +475,85 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[{
-    "id": 4,
-    "name": "Guns N Petals",
-  }, {
-    "id": 5,
-    "name": "Matt Quevedo",
-  }, {
-    "id": 6,
-    "name": "The Wild Sax Band",
-  }]
-  return render_template('pages/artists.html', artists=data)
+  page = artists_page()
+  return render_template('pages/artists.html', artists=page, page=page)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  response={
-    "count": 1,
-    "data": [{
-      "id": 4,
-      "name": "Guns N Petals",
-      "num_upcoming_shows": 0,
-    }]
-  }
+  response = artist_search.search(request.form.get('search_term', ''),
+                                  request.form.get('limit', type=int))
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
+@app.route('/artists/autocomplete')
+def autocomplete_artists():
+  return jsonify(artist_search.autocomplete(request.args.get('q', ''),
+                                            request.args.get('limit', 10, type=int)))
+
+@app.route('/artists/filter')
+def filter_artists():
+  page = genre_filter_page(Artist, artist_genres, 'artist_id')
+  return jsonify({"data": page.items, "next": page.next})
+
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-  data1={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "past_shows": [{
-      "venue_id": 1,
-      "venue_name": "The Musical Hop",
-      "venue_image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data2={
-    "id": 5,
-    "name": "Matt Quevedo",
-    "genres": ["Jazz"],
-    "city": "New York",
-    "state": "NY",
-    "phone": "300-400-5000",
-    "facebook_link": "https://www.facebook.com/mattquevedo923251523",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "past_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data3={
-    "id": 6,
-    "name": "The Wild Sax Band",
-    "genres": ["Jazz", "Classical"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "432-325-5432",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "past_shows": [],
-    "upcoming_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 3,
-  }
-  data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
+  data = artist_detail(artist_id)
+  if data is None:
+    abort(404)
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  form = ArtistForm()
-  artist={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80"
-  }
-  # TODO: populate form with fields from artist with ID <artist_id>
+  artist = Artist.query.get_or_404(artist_id)
+  form = ArtistForm(formdata=None, obj=artist, version=artist.version_id)
+  form.genres.data = list(genre_names(artist))
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # TODO: take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
-
+  version = request.form.get('version', type=int)
+  if version is None:
+    abort(400)
+  try:
+    artist = update(Artist, artist_id, version, artist_values(request.form))
+  except EditConflict:
+    flash('Artist was changed by someone else while you were editing. '
+          'Their changes are shown below; make your edits again.')
+    return edit_artist(artist_id), 409
+  except SQLAlchemyError:
+    app.logger.exception('editing artist %s failed', artist_id)
+    flash('An error occurred. Artist could not be updated.')
+    return redirect(url_for('edit_artist', artist_id=artist_id))
+  if artist is None:
+    abort(404)
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  form = VenueForm()
-  venue={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60"
-  }
-  # TODO: populate form with values from venue with ID <venue_id>
+  venue = Venue.query.get_or_404(venue_id)
+  form = VenueForm(formdata=None, obj=venue, version=venue.version_id)
+  form.genres.data = list(genre_names(venue))
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # TODO: take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
+  version = request.form.get('version', type=int)
+  if version is None:
+    abort(400)
+  try:
+    venue = update(Venue, venue_id, version, venue_values(request.form))
+  except EditConflict:
+    flash('Venue was changed by someone else while you were editing. '
+          'Their changes are shown below; make your edits again.')
+    return edit_venue(venue_id), 409
+  except SQLAlchemyError:
+    app.logger.exception('editing venue %s failed', venue_id)
+    flash('An error occurred. Venue could not be updated.')
+    return redirect(url_for('edit_venue', venue_id=venue_id))
+  if venue is None:
+    abort(404)
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
@@ -413,13 +567,13 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
-  # TODO: insert form data as a new Venue record in the db, instead
-  # TODO: modify data to be the data object returned from db insertion
-
-  # on successful db insert, flash success
+  try:
+    create(Artist, artist_values(request.form))
+  except SQLAlchemyError:
+    app.logger.exception('creating artist failed')
+    flash('An error occurred. Artist ' + request.form.get('name', '') + ' could not be listed.')
+    return render_template('pages/home.html'), 500
   flash('Artist ' + request.form['name'] + ' was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
   return render_template('pages/home.html')
 
 
@@ -428,46 +582,9 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "venue_id": 1,
-    "venue_name": "The Musical Hop",
-    "artist_id": 4,
-    "artist_name": "Guns N Petals",
-    "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "start_time": "2019-05-21T21:30:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 5,
-    "artist_name": "Matt Quevedo",
-    "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "start_time": "2019-06-15T23:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-01T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-08T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-15T20:00:00.000Z"
-  }]
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, a page at a time
+  page = shows_page()
+  return render_template('pages/shows.html', shows=page, page=page)
 
 @app.route('/shows/create')
 def create_shows():
@@ -487,6 +604,11 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+if app.config['INTERNAL_ENDPOINTS']:
+  @app.route('/internal/fragment-cache')
+  def fragment_cache_stats():
+    return jsonify(fragment_cache.stats())
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -497,15 +619,63 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    setup_logging(app)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+SEED_TABLES = {
+  'genres': Genre.__table__,
+  'venues': Venue.__table__,
+  'artists': Artist.__table__,
+  'shows': Show.__table__,
+  'venue_genres': venue_genres,
+  'artist_genres': artist_genres,
+}
+
+@app.cli.group()
+def seed():
+  '''Bulk load venues, artists and shows.'''
+
+def seed_loader(batch_size, truncate):
+  if truncate:
+    for name in ('shows', 'venue_genres', 'artist_genres', 'venues', 'artists'):
+      db.session.execute(SEED_TABLES[name].delete())
+    db.session.commit()
+  return seeding.BulkLoader(db, batch_size=batch_size)
+
+@seed.command('generate')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=1000, show_default=True)
+@click.option('--shows', default=10000, show_default=True)
+@click.option('--genres-per-row', default=2, show_default=True)
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--truncate', is_flag=True, help='Delete existing venues, artists and shows first.')
+def seed_generate(venues, artists, shows, genres_per_row, batch_size, truncate):
+  '''Insert synthetic venues, artists and shows.'''
+  loader = seed_loader(batch_size, truncate)
+  counts = seeding.generate(loader, SEED_TABLES, venues, artists, shows, genres_per_row)
+  fragment_cache.bump('Venue', 'Artist', 'Show')
+  click.echo(', '.join('{:,} {}'.format(n, kind) for kind, n in counts.items()))
+
+@seed.command('load')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--truncate', is_flag=True, help='Delete existing venues, artists and shows first.')
+def seed_load(kind, path, batch_size, truncate):
+  '''Load KIND rows from a CSV (with a header) or NDJSON file.'''
+  loader = seed_loader(batch_size, truncate)
+  try:
+    count = seeding.ingest(loader, SEED_TABLES, kind, path)
+  except (SQLAlchemyError, ValueError) as e:
+    # each table is loaded in one transaction, so nothing of it was written
+    raise click.ClickException('{} not loaded: {}'.format(kind, getattr(e, 'orig', e)))
+  fragment_cache.bump('Venue', 'Artist', 'Show')
+  click.echo('{:,} {}'.format(count, kind))
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,405 @@
+'''
+Benchmarks for Fyyur.
+
+Each benchmark seeds a throwaway database (sqlite unless --database-url is
+given) at a few sizes and reports, per size, the number of SQL statements
+and the time a request takes:
+
+    python benchmark.py venues --sizes 100 1000 10000
+    python benchmark.py search --sizes 1000 100000
+    python benchmark.py filter --sizes 10000
+    python benchmark.py edits --sizes 1 8 32 --repeat 20
+    python benchmark.py genres --sizes 10000 100000
+
+Seeding drops and recreates the tables, so a --database-url whose tables
+already hold rows is refused unless --reset is given.
+'''
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from seeding import CITIES, GENRES
+
+
+def load_app(database_url, disable_caches=False):
+  # config.py reads DATABASE_URL and the cache settings when app is first imported
+  if not database_url:
+    database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+  os.environ['DATABASE_URL'] = database_url
+  if disable_caches:
+    os.environ['FRAGMENT_CACHE_SIZE'] = '0'
+  import app
+  return app
+
+
+class QueryCounter:
+  '''Counts the statements executed on `engine` inside the with block.'''
+  def __init__(self, engine):
+    self.engine = engine
+    self.count = 0
+
+  def _count(self, *args):
+    self.count += 1
+
+  def __enter__(self):
+    from sqlalchemy import event
+    event.listen(self.engine, 'before_cursor_execute', self._count)
+    return self
+
+  def __exit__(self, *exc):
+    from sqlalchemy import event
+    event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def holds_rows(db):
+  '''Whether any of the models' tables already exists with rows in it.'''
+  from sqlalchemy import inspect
+  existing = set(inspect(db.engine).get_table_names())
+  return any(db.session.execute(table.select().limit(1)).first() is not None
+             for table in db.metadata.sorted_tables if table.name in existing)
+
+
+def seed(fyyur, venues, artists, shows_per_venue, genres_per_row=0, batch_size=10000):
+  db = fyyur.db
+  db.drop_all()
+  db.create_all()
+  now = datetime.now()
+
+  def insert(table, count, row):
+    for start in range(0, count, batch_size):
+      stop = min(start + batch_size, count)
+      db.session.execute(table.insert(), [row(i) for i in range(start, stop)])
+    db.session.commit()
+
+  insert(fyyur.Venue.__table__, venues, lambda i: dict(
+    name='Venue {}'.format(i), city=CITIES[i % len(CITIES)][0],
+    state=CITIES[i % len(CITIES)][1]))
+  insert(fyyur.Artist.__table__, artists, lambda i: dict(
+    name='Artist {}'.format(i), city=CITIES[i % len(CITIES)][0],
+    state=CITIES[i % len(CITIES)][1]))
+  insert(fyyur.Show.__table__, venues * shows_per_venue, lambda i: dict(
+    venue_id=i // shows_per_venue + 1, artist_id=random.randint(1, artists),
+    start_time=now + timedelta(days=random.randint(-365, 365))))
+
+  if genres_per_row:
+    insert(fyyur.Genre.__table__, len(GENRES), lambda i: dict(name=GENRES[i]))
+    # row i gets genres_per_row consecutive genres starting at a random one
+    starts = {}
+    def link(fk, count):
+      def row(i):
+        owner, offset = divmod(i, genres_per_row)
+        start = starts.setdefault((fk, owner), random.randrange(len(GENRES)))
+        return {fk: owner + 1, 'genre_id': (start + offset) % len(GENRES) + 1}
+      return count * genres_per_row, row
+    insert(fyyur.venue_genres, *link('venue_id', venues))
+    insert(fyyur.artist_genres, *link('artist_id', artists))
+
+  # core inserts bypass the model events that bump fragment versions, and the
+  # new rows reuse the old ids: drop everything rendered from the last size
+  fyyur.fragment_cache.clear()
+
+
+def timed_request(fyyur, method, path, repeat, cached=False, **kwargs):
+  '''
+  Statement counts of a cold and a warm request to `path`, and the latency
+  of `repeat` more. A `cached` page is wrapped in the fragment cache, so its
+  cold request must still go to the database.
+  '''
+  client = fyyur.app.test_client()
+  with QueryCounter(fyyur.db.engine) as counter:
+    client.open(path, method=method, **kwargs).get_data()
+  if cached and not counter.count:
+    raise RuntimeError('{} was served from the fragment cache on a cold request'.format(path))
+  # the second request is served from the fragment cache where there is one
+  with QueryCounter(fyyur.db.engine) as warm_counter:
+    client.open(path, method=method, **kwargs).get_data()
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    client.open(path, method=method, **kwargs).get_data()
+    timings.append(time.perf_counter() - start)
+  timings.sort()
+  return {
+    'queries': counter.count,
+    'warm_queries': warm_counter.count,
+    'p50_ms': round(1000 * timings[len(timings) // 2], 3),
+    'max_ms': round(1000 * timings[-1], 3)
+  }
+
+
+def bench_venues(fyyur, args):
+  results = []
+  for size in args.sizes:
+    seed(fyyur, venues=size, artists=max(1, size // 2), shows_per_venue=args.shows)
+    result = timed_request(fyyur, 'GET', '/venues', args.repeat)
+    result['venues'] = size
+    results.append(result)
+  return results
+
+
+def bench_search(fyyur, args):
+  results = []
+  for size in args.sizes:
+    seed(fyyur, venues=size, artists=max(1, size // 2), shows_per_venue=args.shows)
+    fyyur.venue_search.invalidate()
+    for term in ('Venue 1', 'enue 99', 'zzz'):
+      result = timed_request(fyyur, 'POST', '/venues/search', args.repeat,
+                             data={'search_term': term})
+      result.update(venues=size, term=term)
+      results.append(result)
+    result = timed_request(fyyur, 'GET', '/venues/autocomplete?q=Venue+12', args.repeat)
+    result.update(venues=size, term='autocomplete')
+    results.append(result)
+  return results
+
+
+def bench_detail(fyyur, args):
+  results = []
+  for size in args.sizes:
+    seed(fyyur, venues=size, artists=max(1, size // 2), shows_per_venue=args.shows)
+    for path in ('/venues/1', '/artists/1'):
+      result = timed_request(fyyur, 'GET', path, args.repeat, cached=True)
+      result.update(venues=size, path=path)
+      results.append(result)
+  return results
+
+
+def bench_pages(fyyur, args):
+  from pagination import encode_cursor
+  Show, Artist = fyyur.Show, fyyur.Artist
+  results = []
+  for size in args.sizes:
+    seed(fyyur, venues=size, artists=size, shows_per_venue=args.shows)
+    # cursors for the last page; found with OFFSET once here, the
+    # requests themselves seek straight to it
+    deep_show = fyyur.db.session.query(Show.start_time, Show.id).order_by(
+      Show.start_time, Show.id).offset(size * args.shows - 20).first()
+    deep_artist = fyyur.db.session.query(Artist.name, Artist.id).order_by(
+      Artist.name, Artist.id).offset(size - 20).first()
+    for page, path in (
+        ('first', '/shows'),
+        ('last', '/shows?after=' + encode_cursor(deep_show)),
+        ('first', '/artists'),
+        ('last', '/artists?after=' + encode_cursor(deep_artist))):
+      result = timed_request(fyyur, 'GET', path, args.repeat, cached=True)
+      result.update(rows=size, path=path.split('?')[0], page=page)
+      results.append(result)
+  return results
+
+
+def edit_artist_phone(client, artist_id):
+  '''
+  One read-modify-write of the artist's phone, used as a counter: load the
+  edit form, add one to the phone it shows and submit it with the form's
+  version. Returns the submission's status code.
+  '''
+  page = client.get('/artists/{}/edit'.format(artist_id)).get_data(as_text=True)
+  version = re.search(r'name="version" type="hidden" value="(\d+)"', page).group(1)
+  phone = re.search(r'name="phone"[^>]*value="(\d+)"', page).group(1)
+  return client.post('/artists/{}/edit'.format(artist_id), data={
+    'name': 'Artist 0', 'phone': str(int(phone) + 1), 'version': version
+  }).status_code
+
+def bench_edits(fyyur, args):
+  '''
+  Load test for concurrent edits: --sizes is the number of clients, each
+  making --repeat successful edits to the same artist and retrying on a
+  409. With no lost updates the final phone equals clients * repeat.
+  '''
+  Artist = fyyur.Artist
+  results = []
+  for clients in args.sizes:
+    seed(fyyur, venues=1, artists=1, shows_per_venue=0)
+    Artist.query.get(1).phone = '0'
+    fyyur.db.session.commit()
+    counts = {'edits': 0, 'conflicts': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def client_loop():
+      client = fyyur.app.test_client()
+      done = attempts = 0
+      while done < args.repeat and attempts < args.repeat * 100:
+        attempts += 1
+        status = edit_artist_phone(client, 1)
+        key = 'edits' if status == 302 else 'conflicts' if status == 409 else 'errors'
+        done += key == 'edits'
+        with lock:
+          counts[key] += 1
+
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.perf_counter() - start
+
+    fyyur.db.session.remove()
+    final = int(Artist.query.get(1).phone)
+    results.append(dict(counts, clients=clients, final_value=final,
+                        lost_updates=counts['edits'] - final,
+                        edits_per_s=round(counts['edits'] / elapsed, 1)))
+  return results
+
+
+def p50_ms(fn, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    timings.append(time.perf_counter() - start)
+  timings.sort()
+  return round(1000 * timings[len(timings) // 2], 3)
+
+def legacy_venue_table(fyyur):
+  '''The venues as they would be stored before normalization: genres comma-joined in a column.'''
+  import sqlalchemy as sa
+  db, Venue, Genre = fyyur.db, fyyur.Venue, fyyur.Genre
+  table = sa.Table('legacy_venue', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String), sa.Column('city', sa.String(120)),
+    sa.Column('state', sa.String(120)), sa.Column('genres', sa.String(120)),
+    sa.Index('ix_legacy_venue_city_state', 'city', 'state'))
+  table.drop(db.engine, checkfirst=True)
+  table.create(db.engine)
+  genres = {}
+  for venue_id, name in db.session.query(fyyur.venue_genres.c.venue_id, Genre.name).join(
+      Genre, Genre.id == fyyur.venue_genres.c.genre_id):
+    genres.setdefault(venue_id, []).append(name)
+  rows = [dict(id=v.id, name=v.name, city=v.city, state=v.state, genres=','.join(genres.get(v.id, [])))
+          for v in db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)]
+  db.session.execute(table.insert(), rows)
+  db.session.commit()
+  return table
+
+def bench_genres(fyyur, args):
+  '''
+  "Jazz venues in CA": the normalized genre filter against a LIKE scan of
+  comma-joined genre strings, for the first page and for a full count.
+  '''
+  import sqlalchemy as sa
+  db, Venue = fyyur.db, fyyur.Venue
+  genre, state = 'Jazz', 'CA'
+  results = []
+  for size in args.sizes:
+    seed(fyyur, venues=size, artists=1, shows_per_venue=0, genres_per_row=2)
+    legacy = legacy_venue_table(fyyur)
+    legacy_query = sa.select([legacy.c.id, legacy.c.name, legacy.c.city, legacy.c.state]).where(
+      sa.and_(legacy.c.state == state, legacy.c.genres.like('%' + genre + '%')))
+    path = '/venues/filter?genre={}&state={}'.format(genre, state)
+    with fyyur.app.test_request_context(path):
+      page = fyyur.genre_filter_page(Venue, fyyur.venue_genres, 'venue_id')
+    normalized_query = page.query.statement
+    per_page = fyyur.app.config['PAGE_SIZE']
+
+    # both sides run as Core statements, so only the SQL differs
+    def page_of(query, key):
+      return lambda: db.session.execute(query.order_by(key).limit(per_page)).fetchall()
+
+    def count_of(query):
+      return lambda: db.session.execute(
+        sa.select([sa.func.count()]).select_from(query.alias())).scalar()
+
+    variants = [
+      ('legacy_like', 'page', page_of(legacy_query, legacy.c.id)),
+      ('normalized', 'page', page_of(normalized_query, page.columns[0])),
+      ('legacy_like', 'count', count_of(legacy_query)),
+      ('normalized', 'count', count_of(normalized_query)),
+    ]
+    for storage, kind, fn in variants:
+      results.append({'venues': size, 'storage': storage, 'query': kind,
+                      'p50_ms': p50_ms(fn, args.repeat)})
+    result = timed_request(fyyur, 'GET', path, args.repeat)
+    result.update(venues=size, storage='normalized', query='endpoint')
+    results.append(result)
+    db.session.commit()
+  return results
+
+
+def legacy_format_datetime(value, format='medium'):
+  # the filter before dates.DateFormatter, kept as the baseline
+  import babel.dates
+  import dateutil.parser
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def bench_filter(fyyur, args):
+  '''Throughput of the `datetime` filter alone; --sizes is the number of calls.'''
+  now = datetime.now()
+  filters = [
+    ('legacy_string', legacy_format_datetime, lambda i: (now + timedelta(hours=i % 500)).isoformat()),
+    ('string', fyyur.format_datetime, lambda i: (now + timedelta(hours=i % 500)).isoformat()),
+    ('datetime', fyyur.format_datetime, lambda i: now + timedelta(hours=i % 500)),
+  ]
+  results = []
+  for size in args.sizes:
+    for name, filter, value in filters:
+      values = [value(i) for i in range(size)]
+      start = time.perf_counter()
+      for v in values:
+        filter(v, 'full')
+      elapsed = time.perf_counter() - start
+      results.append({
+        'filter': name,
+        'calls': size,
+        'calls_per_s': round(size / elapsed),
+        'us_per_call': round(1e6 * elapsed / size, 2)
+      })
+  return results
+
+
+BENCHMARKS = {
+  'venues': (bench_venues, 'GET /venues: grouped venue listing with upcoming show counts'),
+  'detail': (bench_detail, 'GET /venues/<id> and /artists/<id>: past and upcoming shows'),
+  'edits': (bench_edits, 'POST /artists/<id>/edit: concurrent read-modify-write load test'),
+  'genres': (bench_genres, 'Jazz venues in CA: normalized genres vs LIKE on a comma-joined column'),
+  'pages': (bench_pages, 'GET /shows and /artists: first and last keyset page'),
+  'filter': (bench_filter, 'datetime Jinja filter: calls per second on 500 distinct show times'),
+  'search': (bench_search, 'POST /venues/search and GET /venues/autocomplete'),
+}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+  parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+  parser.add_argument('--shows', type=int, default=5, help='shows per venue')
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--database-url')
+  parser.add_argument('--reset', action='store_true',
+                      help='drop the tables of --database-url even if they hold rows')
+  parser.add_argument('--output', help='also write the results as JSON')
+  parser.add_argument('--disable-caches', action='store_true',
+                      help='turn off the template fragment cache')
+  args = parser.parse_args(argv)
+
+  fyyur = load_app(args.database_url, args.disable_caches)
+  run, description = BENCHMARKS[args.benchmark]
+  print(description)
+  with fyyur.app.app_context():
+    # every size reseeds from scratch: only wipe a database we created or were told to
+    if args.database_url and not args.reset and holds_rows(fyyur.db):
+      sys.exit('--database-url already holds rows: pass --reset to drop its tables')
+    results = run(fyyur, args)
+
+  for result in results:
+    print('  ' + '  '.join('{}={}'.format(key, value) for key, value in result.items()))
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'benchmark': args.benchmark, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -9,5 +9,28 @@ DEBUG = True
 # Connect to the database
 
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = '<Put your local database url>'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://localhost:5432/fyyur')
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Template fragment cache: entries kept, and seconds before an entry expires.
+# FRAGMENT_CACHE_SIZE=0 turns it off.
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 1024))
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 60))
+
+# The /internal/* endpoints report cache and logging counters without any
+# auth, so they are only served with ENABLE_INTERNAL_ENDPOINTS=true.
+INTERNAL_ENDPOINTS = os.environ.get('ENABLE_INTERNAL_ENDPOINTS', 'false').lower() == 'true'
+
+# Rows per page on /artists and /shows; ?per_page= can ask for up to MAX_PAGE_SIZE.
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+# Logging when DEBUG is off: JSON lines written by a background thread.
+# LOG_ROTATE_WHEN (e.g. 'midnight') rotates on time instead of at LOG_MAX_BYTES;
+# LOG_DROP_POLICY ('newest' or 'oldest') decides what goes when the queue is full.
+LOG_FILE = os.environ.get('LOG_FILE', 'error.log')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_DROP_POLICY = os.environ.get('LOG_DROP_POLICY', 'newest')
@@ -0,0 +1,65 @@
+'''
+Date formatting for templates.
+
+DateFormatter is registered as the `datetime` Jinja filter. Show pages call
+it once per show, so it avoids repeating work between calls: datetimes
+from the database are formatted as they are, ISO strings are parsed once
+and memoized, and each (format, locale) pair is compiled to a babel
+pattern once.
+'''
+import threading
+from datetime import datetime
+from functools import lru_cache
+import dateutil.parser
+from babel import Locale
+from babel.dates import UTC, format_datetime, parse_pattern
+
+
+FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+# babel's own named formats, used when FORMATS doesn't override them
+NAMED_FORMATS = ('full', 'long', 'medium', 'short')
+
+
+class DateFormatter:
+  def __init__(self, locale='en', formats=FORMATS, parse_cache_size=4096):
+    self.locale = locale
+    self.formats = dict(formats)
+    self.parse = lru_cache(maxsize=parse_cache_size)(dateutil.parser.parse)
+    self._patterns = {}
+    self._lock = threading.Lock()
+
+  def pattern(self, format, locale):
+    '''The compiled babel pattern and parsed Locale for (format, locale).'''
+    key = (format, locale)
+    compiled = self._patterns.get(key)
+    if compiled is None:
+      with self._lock:
+        compiled = self._patterns[key] = (
+          parse_pattern(self.formats.get(format, format)), Locale.parse(locale))
+    return compiled
+
+  def format(self, value, format='medium', locale=None):
+    locale = locale or self.locale
+    date = value if isinstance(value, datetime) else self.parse(value)
+    if format in NAMED_FORMATS and format not in self.formats:
+      return format_datetime(date, format, locale=locale)
+    pattern, locale = self.pattern(format, locale)
+    if date.tzinfo is None:
+      # what babel.dates.format_datetime does with naive datetimes
+      date = date.replace(tzinfo=UTC)
+    return pattern.apply(date, locale)
+
+  __call__ = format
+
+  def stats(self):
+    parsed = self.parse.cache_info()
+    return {
+      'parse_hits': parsed.hits,
+      'parse_misses': parsed.misses,
+      'parse_size': parsed.currsize,
+      'patterns': len(self._patterns),
+    }
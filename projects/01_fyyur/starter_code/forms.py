@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, HiddenField
 from wtforms.validators import DataRequired, AnyOf, URL
 
 class ShowForm(Form):
@@ -125,6 +125,10 @@ class VenueForm(Form):
     seeking_description = StringField(
         'seeking_description'
     )
+    # the row version the form was loaded at, for optimistic locking
+    version = HiddenField(
+        'version'
+    )
 
 
 
@@ -236,4 +240,7 @@ class ArtistForm(Form):
     seeking_description = StringField(
             'seeking_description'
      )
+    version = HiddenField(
+        'version'
+    )
 
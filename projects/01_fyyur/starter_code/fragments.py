@@ -0,0 +1,162 @@
+'''
+Fragment caching for Jinja templates.
+
+    {% cache 'show_venue', ('Venue', venue.id), 'Artist' %}
+      ...
+    {% endcache %}
+
+renders the block once and serves the stored HTML until one of its
+dependencies changes. A dependency is either a (table, id) pair, for one
+row, or a bare table name, for any row of that table. Each has a version
+number that is part of the cache key; FragmentCache.watch() hooks the
+models' after_insert/after_update/after_delete events to bump the versions
+of the rows (and tables) they touch, so stale entries are simply never
+looked up again and age out of the LRU.
+
+Pages that show "upcoming" or "past" shows also go stale as time passes
+with no write at all, so entries expire after `ttl` seconds regardless.
+
+Only the `max_versions` most recently bumped dependencies keep their own
+version. Older ones are forgotten, and a dependency without a version
+reads as the newest version forgotten so far: never older than what it
+was last bumped to, so an entry rendered before that bump can't match.
+'''
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+
+class FragmentCache:
+  def __init__(self, max_size=1024, ttl=60, max_versions=100000, clock=time.monotonic):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.max_versions = max_versions
+    self.clock = clock
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._versions = OrderedDict()
+    self._forgotten = 0
+    self._counter = count(1)
+    self._lock = threading.Lock()
+
+  def version(self, dependency):
+    with self._lock:
+      return self._versions.get(dependency, self._forgotten)
+
+  def bump(self, *dependencies):
+    with self._lock:
+      for dependency in dependencies:
+        self._versions[dependency] = next(self._counter)
+        self._versions.move_to_end(dependency)
+      # in bump order, so the first entry holds the lowest version
+      while len(self._versions) > self.max_versions:
+        self._forgotten = self._versions.popitem(last=False)[1]
+
+  def key(self, name, dependencies):
+    dependencies = [tuple(d) if isinstance(d, list) else d for d in dependencies]
+    return (name,) + tuple((d, self.version(d)) for d in dependencies)
+
+  def fragment(self, name, dependencies, render):
+    '''The cached HTML for `name` at the current dependency versions, or render() stored.'''
+    if self.max_size <= 0:
+      return render()
+    key = self.key(name, dependencies)
+    now = self.clock()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[0] > now:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+      self.misses += 1
+    html = render()
+    with self._lock:
+      self._entries[key] = (now + self.ttl, html)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+    return html
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'size': len(self._entries),
+      'max_size': self.max_size,
+      'ttl': self.ttl,
+      'versions': len(self._versions),
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+    }
+
+  def watch(self, model, *references):
+    '''
+    Invalidate fragments depending on `model` rows when they change.
+    `references` names foreign key attributes whose targets are affected
+    too, e.g. watch(Show, ('Venue', 'venue_id'), ('Artist', 'artist_id')).
+
+    Versions are bumped when the change is flushed and again when the
+    session commits, so a page rendered from the old rows between the two
+    can't be cached under the new version.
+    '''
+    table = model.__tablename__
+
+    def changed(mapper, connection, target):
+      dependencies = [table, (table, target.id)]
+      for referenced, attribute in references:
+        dependencies += [referenced, (referenced, getattr(target, attribute))]
+      self.bump(*dependencies)
+      session = object_session(target)
+      if session is not None:
+        session.info.setdefault('fragment_dependencies', set()).update(dependencies)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+      event.listen(model, name, changed)
+
+  def watch_session(self, session):
+    @event.listens_for(session, 'after_commit')
+    def after_commit(session):
+      dependencies = session.info.pop('fragment_dependencies', None)
+      if dependencies:
+        self.bump(*dependencies)
+
+    @event.listens_for(session, 'after_rollback')
+    def after_rollback(session):
+      session.info.pop('fragment_dependencies', None)
+
+
+class FragmentCacheExtension(Extension):
+  '''The {% cache name, dependency, ... %} tag, backed by environment.fragment_cache.'''
+  tags = {'cache'}
+
+  def __init__(self, environment):
+    super().__init__(environment)
+    environment.extend(fragment_cache=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    while parser.stream.skip_if('comma'):
+      args.append(parser.parse_expression())
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(
+      self.call_method('_render', [args[0], nodes.List(args[1:])]), [], [], body
+    ).set_lineno(lineno)
+
+  def _render(self, name, dependencies, caller):
+    cache = self.environment.fragment_cache
+    if cache is None:
+      return caller()
+    return cache.fragment(name, dependencies, caller)
@@ -0,0 +1,195 @@
+'''
+Non-blocking file logging.
+
+Request threads only put records on a bounded queue (QueueHandler); a
+QueueListener thread formats them as JSON lines and writes them to a
+rotating file. When the queue is full records are dropped rather than
+making the request wait, according to `drop_policy`:
+
+    'newest'  drop the record being logged
+    'oldest'  drop the oldest queued record to make room for it
+
+and counted per level. Records logged during a request carry its request
+id (the X-Request-ID header, or a generated one, echoed in the response)
+and the time since the request started; every request also logs one
+access record with its status and latency.
+'''
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from flask import g, has_request_context, jsonify, request
+from flask.logging import default_handler
+
+
+class JSONFormatter(logging.Formatter):
+  FIELDS = ('request_id', 'method', 'path', 'status', 'latency_ms')
+
+  def format(self, record):
+    entry = {
+      'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+      'module': record.module,
+      'line': record.lineno,
+    }
+    for field in self.FIELDS:
+      value = getattr(record, field, None)
+      if value is not None:
+        entry[field] = value
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      entry['exception'] = record.exc_text
+    return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+  '''Adds the current request's id, method, path and elapsed time to records logged inside it.'''
+  def filter(self, record):
+    if has_request_context() and 'request_id' in g:
+      record.request_id = g.request_id
+      if getattr(record, 'latency_ms', None) is None:
+        record.latency_ms = round(1000 * (time.perf_counter() - g.request_start), 3)
+      record.method = getattr(record, 'method', None) or request.method
+      record.path = getattr(record, 'path', None) or request.path
+    return True
+
+
+class DroppingQueueHandler(QueueHandler):
+  def __init__(self, queue, drop_policy='newest'):
+    super().__init__(queue)
+    if drop_policy not in ('newest', 'oldest'):
+      raise ValueError('drop_policy must be "newest" or "oldest"')
+    self.drop_policy = drop_policy
+    self.enqueued = 0
+    self.dropped = {}
+    self._lock = threading.Lock()
+
+  def prepare(self, record):
+    '''
+    Resolve the message and traceback here, in the logging thread, so the
+    listener never touches request state or unpicklable args; leave the
+    JSON formatting to the listener.
+    '''
+    record = logging.makeLogRecord(record.__dict__)
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      if self.drop_policy == 'oldest':
+        try:
+          dropped = self.queue.get_nowait()
+        except queue.Empty:
+          dropped = None
+        self._count_drop(dropped or record)
+        try:
+          self.queue.put_nowait(record)
+        except queue.Full:
+          self._count_drop(record)
+          return
+      else:
+        self._count_drop(record)
+        return
+    with self._lock:
+      self.enqueued += 1
+
+  def _count_drop(self, record):
+    with self._lock:
+      self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+
+class Listener(QueueListener):
+  def enqueue_sentinel(self):
+    # the queue may be full when we stop: wait for room instead of raising
+    self.queue.put(self._sentinel)
+
+
+def file_handler(path, max_bytes=0, backup_count=5, when=None):
+  '''Rotates every `when` (a TimedRotatingFileHandler interval) if given, else at `max_bytes`.'''
+  if when:
+    return TimedRotatingFileHandler(path, when=when, backupCount=backup_count, delay=True)
+  return RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+
+
+class LoggingPipeline:
+  def __init__(self, handler, queue_size=10000, drop_policy='newest', level=logging.INFO):
+    handler.setFormatter(JSONFormatter())
+    self.queue = queue.Queue(maxsize=queue_size)
+    self.queue_handler = DroppingQueueHandler(self.queue, drop_policy)
+    self.queue_handler.setLevel(level)
+    self.queue_handler.addFilter(RequestContextFilter())
+    self.listener = Listener(self.queue, handler, respect_handler_level=True)
+    self.level = level
+    self.running = False
+
+  def init_app(self, app, stats_path=None):
+    '''Attach to app.logger; the drop counters are served at `stats_path` if given.'''
+    app.extensions['logging_pipeline'] = self
+    app.logger.setLevel(self.level)
+    # Flask's default handler writes to stderr from the request thread
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(self.queue_handler)
+    app.before_request(self._before_request)
+    app.after_request(self._after_request)
+    if stats_path:
+      app.add_url_rule(stats_path, 'logging_stats', lambda: jsonify(self.stats()))
+    self.listener.start()
+    self.running = True
+    atexit.register(self.stop)
+    self.logger = app.logger
+    return self
+
+  def stop(self):
+    '''Flush what is queued and stop the listener thread.'''
+    if self.running:
+      self.running = False
+      self.listener.stop()
+
+  def _before_request(self):
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+  def _after_request(self, response):
+    if 'request_id' not in g:
+      return response
+    response.headers['X-Request-ID'] = g.request_id
+    latency_ms = round(1000 * (time.perf_counter() - g.request_start), 3)
+    self.logger.info('%s %s %s', request.method, request.path, response.status_code,
+                     extra={'status': response.status_code, 'latency_ms': latency_ms})
+    return response
+
+  def stats(self):
+    handler = self.queue_handler
+    return {
+      'queued': self.queue.qsize(),
+      'queue_size': self.queue.maxsize,
+      'drop_policy': handler.drop_policy,
+      'enqueued': handler.enqueued,
+      'dropped': dict(handler.dropped),
+      'dropped_total': sum(handler.dropped.values()),
+    }
+
+
+def setup_logging(app):
+  '''The pipeline described by the app's LOG_* settings, attached to app.logger.'''
+  config = app.config
+  handler = file_handler(config['LOG_FILE'], max_bytes=config['LOG_MAX_BYTES'],
+                         backup_count=config['LOG_BACKUP_COUNT'], when=config['LOG_ROTATE_WHEN'])
+  pipeline = LoggingPipeline(handler, queue_size=config['LOG_QUEUE_SIZE'],
+                             drop_policy=config['LOG_DROP_POLICY'])
+  stats_path = '/internal/logging' if config['INTERNAL_ENDPOINTS'] else None
+  return pipeline.init_app(app, stats_path)
@@ -0,0 +1,32 @@
+"""add trigram name indexes
+
+Revision ID: 5c1e7a93b2f0
+Revises: d041fa8cf43b
+Create Date: 2026-10-18 19:02:41.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a93b2f0'
+down_revision = 'd041fa8cf43b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # other databases get a plain index on name; search.py searches them
+    # through its in-memory trigram index
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venue_name_trgm', 'Venue', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artist_name_trgm', 'Artist', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_venue_name_trgm', table_name='Venue')
@@ -0,0 +1,95 @@
+"""normalize genres
+
+Revision ID: 9b2e5c7d0f14
+Revises: 3f6d1b8e4a27
+Create Date: 2026-10-18 21:48:02.640913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e5c7d0f14'
+down_revision = '3f6d1b8e4a27'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+artist = sa.table('Artist', sa.column('id', sa.Integer), sa.column('genres', sa.String))
+genre = sa.table('Genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+artist_genres = sa.table('artist_genres', sa.column('genre_id', sa.Integer),
+                         sa.column('artist_id', sa.Integer))
+
+
+def upgrade():
+    op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('artist_genres',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id', 'artist_id')
+    )
+    op.create_index('ix_artist_genres_artist_id', 'artist_genres', ['artist_id'], unique=False)
+    op.create_table('venue_genres',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id', 'venue_id')
+    )
+    op.create_index('ix_venue_genres_venue_id', 'venue_genres', ['venue_id'], unique=False)
+
+    # split the comma-joined Artist.genres strings: one pass to collect the
+    # distinct names, one multi-row insert for the genres and batched
+    # multi-row inserts for the links
+    bind = op.get_bind()
+    links = []
+    names = set()
+    rows = bind.execute(sa.select([artist.c.id, artist.c.genres])
+                        .where(artist.c.genres.isnot(None)))
+    for artist_id, genres in rows:
+        for name in {name.strip() for name in genres.split(',') if name.strip()}:
+            names.add(name)
+            links.append((artist_id, name))
+    if names:
+        op.bulk_insert(genre, [{'name': name} for name in sorted(names)])
+        ids = dict(bind.execute(sa.select([genre.c.name, genre.c.id])).fetchall())
+        for start in range(0, len(links), BATCH_SIZE):
+            op.bulk_insert(artist_genres, [
+                {'genre_id': ids[name], 'artist_id': artist_id}
+                for artist_id, name in links[start:start + BATCH_SIZE]])
+
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.drop_column('genres')
+
+
+def downgrade():
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.add_column(sa.Column('genres', sa.String(length=120), nullable=True))
+
+    bind = op.get_bind()
+    joined = {}
+    rows = bind.execute(sa.select([artist_genres.c.artist_id, genre.c.name])
+                        .select_from(artist_genres.join(genre, genre.c.id == artist_genres.c.genre_id))
+                        .order_by(artist_genres.c.artist_id, genre.c.name))
+    for artist_id, name in rows:
+        joined.setdefault(artist_id, []).append(name)
+    if joined:
+        bind.execute(artist.update().where(artist.c.id == sa.bindparam('artist_id'))
+                     .values(genres=sa.bindparam('joined_genres')),
+                     [{'artist_id': artist_id, 'joined_genres': ','.join(names)[:120]}
+                      for artist_id, names in joined.items()])
+
+    op.drop_index('ix_venue_genres_venue_id', table_name='venue_genres')
+    op.drop_table('venue_genres')
+    op.drop_index('ix_artist_genres_artist_id', table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_table('Genre')
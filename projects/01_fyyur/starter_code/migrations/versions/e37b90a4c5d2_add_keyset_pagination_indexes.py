@@ -0,0 +1,33 @@
+"""add keyset pagination indexes
+
+Revision ID: e37b90a4c5d2
+Revises: 8a4f2d6c1e93
+Create Date: 2026-10-18 20:26:53.871460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e37b90a4c5d2'
+down_revision = '8a4f2d6c1e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # artists are paged on (name, id); a NULL name would drop out of every
+    # (name, id) > (:name, :id) comparison
+    op.execute('''UPDATE "Artist" SET name = '' WHERE name IS NULL''')
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(), nullable=False)
+    op.create_index('ix_artist_name_id', 'Artist', ['name', 'id'], unique=False)
+    op.create_index('ix_show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_start_time_id', table_name='Show')
+    op.drop_index('ix_artist_name_id', table_name='Artist')
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(), nullable=True)
@@ -0,0 +1,124 @@
+'''
+Keyset (seek) pagination.
+
+A page is addressed by the sort key of the row just before it (`after`) or
+just after it (`before`), never by an offset:
+
+    WHERE (start_time, id) > (:start_time, :id) ORDER BY start_time, id LIMIT n
+
+With an index on the sort columns every page, however deep, is an index
+range scan of `n` rows. The key always ends with the primary key so it is
+unique and no row is skipped or repeated between pages.
+'''
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+def encode_cursor(values):
+  values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+  return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+  '''Raises ValueError for anything that isn't a cursor for these columns.'''
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+  except (TypeError, ValueError) as e:
+    raise ValueError('invalid cursor') from e
+  if not isinstance(values, list) or len(values) != len(columns):
+    raise ValueError('invalid cursor')
+  return [decode_value(value, column) for value, column in zip(values, columns)]
+
+def decode_value(value, column):
+  '''The cursor's value for `column`, checked against the column's type.'''
+  python_type = column.type.python_type
+  if value is None and column.nullable:
+    return None
+  if python_type is datetime:
+    if isinstance(value, str):
+      try:
+        return datetime.fromisoformat(value)
+      except ValueError:
+        pass
+  # bool is an int, but no sort key is a bool
+  elif isinstance(value, python_type) and not isinstance(value, bool):
+    return value
+  raise ValueError('invalid cursor')
+
+
+class KeysetPage:
+  '''
+  One page of `query` ordered by `columns`. Nothing is queried until the
+  items or the navigation properties are first used, so a page rendered
+  inside a cached template fragment costs no query on a cache hit.
+  Cursors are decoded up front: a malformed one raises ValueError here
+  rather than halfway through rendering.
+  '''
+  def __init__(self, query, columns, per_page, after=None, before=None, format=None):
+    self.query = query
+    self.columns = columns
+    self.per_page = per_page
+    self.after = after
+    self.before = before
+    self.format = format
+    self._after_values = decode_cursor(after, columns) if after else None
+    self._before_values = decode_cursor(before, columns) if before else None
+    self._items = None
+
+  @property
+  def key(self):
+    '''Identifies the page among the pages of the same listing.'''
+    return '{}:{}:{}'.format(self.after or '', self.before or '', self.per_page)
+
+  def _load(self):
+    if self._items is not None:
+      return
+    keys = tuple_(*self.columns)
+    query = self.query
+    if self.before:
+      query = query.filter(keys < tuple_(*self._before_values)
+        ).order_by(*[column.desc() for column in self.columns])
+    else:
+      if self.after:
+        query = query.filter(keys > tuple_(*self._after_values))
+      query = query.order_by(*self.columns)
+    # one extra row tells whether there is another page in that direction
+    rows = query.limit(self.per_page + 1).all()
+    more = len(rows) > self.per_page
+    rows = rows[:self.per_page]
+    if self.before:
+      rows.reverse()
+      self.has_prev, self.has_next = more, True
+    else:
+      self.has_prev, self.has_next = bool(self.after), more
+    names = [column.key for column in self.columns]
+    self.prev_cursor = encode_cursor([getattr(rows[0], name) for name in names]) if rows else None
+    self.next_cursor = encode_cursor([getattr(rows[-1], name) for name in names]) if rows else None
+    self._items = [self.format(row) for row in rows] if self.format else rows
+
+  @property
+  def items(self):
+    self._load()
+    return self._items
+
+  def __iter__(self):
+    return iter(self.items)
+
+  @property
+  def prev(self):
+    '''Query string arguments for the previous page, or None on the first.'''
+    self._load()
+    return {'before': self.prev_cursor} if self.has_prev and self.prev_cursor else None
+
+  @property
+  def next(self):
+    self._load()
+    return {'after': self.next_cursor} if self.has_next and self.next_cursor else None
+
+
+def page_from_request(args, query, columns, default_per_page, max_per_page, format=None):
+  '''A KeysetPage from the `after`, `before` and `per_page` query string arguments.'''
+  per_page = min(max(args.get('per_page', default_per_page, type=int), 1), max_per_page)
+  return KeysetPage(query, columns, per_page, after=args.get('after'),
+                    before=args.get('before'), format=format)
@@ -0,0 +1,207 @@
+'''
+Case-insensitive partial-match search on a name column.
+
+On Postgres the name column carries a pg_trgm GIN index: ILIKE '%term%'
+and ILIKE 'prefix%' are answered from it and results are ranked with
+similarity(). Other databases (sqlite in development and tests) get the
+same behaviour from NgramIndex, an in-memory trigram index rebuilt after
+changes to the model are committed.
+'''
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import DDL, and_, event, func, literal
+from sqlalchemy.orm import object_session
+
+
+def trigrams(text):
+  '''Overlapping 3-character slices of the lowercased text.'''
+  text = text.lower()
+  return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def word_trigrams(text):
+  '''pg_trgm style trigrams: every word padded with two leading and one trailing space.'''
+  grams = set()
+  for word in re.findall(r'\w+', text.lower()):
+    padded = '  ' + word + ' '
+    grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+  return grams
+
+def trigram_similarity(grams_a, grams_b):
+  if not grams_a or not grams_b:
+    return 0.0
+  return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class NgramIndex:
+  '''
+  Inverted trigram index over (id, name) pairs. A name contains the term
+  only if it contains every trigram of the term, so candidates come from
+  intersecting posting lists and are then confirmed with a substring test.
+  A sorted list of lowercased names answers prefix lookups.
+  '''
+  def __init__(self, rows=()):
+    self.build(rows)
+
+  def build(self, rows):
+    self.names = {}
+    self.word_grams = {}
+    self.postings = {}
+    for id, name in rows:
+      name = name or ''
+      self.names[id] = name
+      self.word_grams[id] = word_trigrams(name)
+      for gram in trigrams(name):
+        self.postings.setdefault(gram, set()).add(id)
+    self.sorted_names = sorted((name.lower(), id) for id, name in self.names.items())
+
+  def candidates(self, term):
+    grams = trigrams(term)
+    if not grams:
+      # shorter than a trigram: nothing to intersect, check every name
+      return self.names.keys()
+    postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+    return set.intersection(*postings)
+
+  def search(self, term, limit):
+    '''(count, ids): how many names contain `term` and the best `limit` of them.'''
+    needle = term.lower()
+    matches = [id for id in self.candidates(needle) if needle in self.names[id].lower()]
+    term_grams = word_trigrams(term)
+    rank = lambda id: (-trigram_similarity(self.word_grams[id], term_grams), self.names[id].lower(), id)
+    return len(matches), heapq.nsmallest(limit, matches, key=rank)
+
+  def prefix(self, prefix, limit):
+    prefix = prefix.lower()
+    ids = []
+    index = bisect_left(self.sorted_names, (prefix,))
+    while index < len(self.sorted_names) and len(ids) < limit:
+      name, id = self.sorted_names[index]
+      if not name.startswith(prefix):
+        break
+      ids.append(id)
+      index += 1
+    return ids
+
+
+class NameSearch:
+  '''
+  Search over `model.name` returning {id, name, num_upcoming_shows} rows.
+  The upcoming show counts are aggregated in the same query that loads the
+  matches (a left join on future shows through `show_fk`), never per row.
+  '''
+  def __init__(self, db, model, show_model, show_fk, limit=50):
+    self.db = db
+    self.model = model
+    self.show_model = show_model
+    self.show_fk = show_fk
+    self.limit = limit
+    self._index = None
+    self._lock = threading.Lock()
+    for name in ('after_insert', 'after_update', 'after_delete'):
+      event.listen(model, name, self._changed)
+    event.listen(db.session, 'after_commit', self._after_commit)
+    event.listen(db.session, 'after_rollback', self._after_rollback)
+
+  def invalidate(self):
+    # under the lock, so an index being built from the old rows isn't kept
+    with self._lock:
+      self._index = None
+
+  # dropping the index at flush would let a reader rebuild it from the
+  # uncommitted rows, or keep it after a rollback: wait for the commit
+  def _changed(self, mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+      session.info[(self, 'stale')] = True
+
+  def _after_commit(self, session):
+    if session.info.pop((self, 'stale'), False):
+      self.invalidate()
+
+  def _after_rollback(self, session):
+    session.info.pop((self, 'stale'), None)
+
+  def clamp(self, limit, default):
+    '''`limit` from the request, kept within 1..self.limit.'''
+    return max(1, min(limit or default, self.limit))
+
+  def use_trigram_index(self):
+    return self.db.engine.dialect.name == 'postgresql'
+
+  def index(self):
+    with self._lock:
+      if self._index is None:
+        rows = self.db.session.query(self.model.id, self.model.name).yield_per(10000)
+        self._index = NgramIndex(rows)
+      return self._index
+
+  def _with_upcoming_shows(self, now=None):
+    model, show = self.model, self.show_model
+    return self.db.session.query(
+        model.id, model.name,
+        func.count(show.id).label('num_upcoming_shows')
+      ).outerjoin(show, and_(self.show_fk == model.id, show.start_time > (now or datetime.now()))
+      ).group_by(model.id, model.name)
+
+  @staticmethod
+  def _format(row):
+    return {
+      "id": row.id,
+      "name": row.name,
+      "num_upcoming_shows": row.num_upcoming_shows,
+    }
+
+  def search(self, term, limit=None):
+    '''{count, data}: the number of matching names and the best `limit` of them.'''
+    limit = self.clamp(limit, self.limit)
+    term = term.strip()
+    if self.use_trigram_index():
+      pattern = '%' + escape_like(term) + '%'
+      rows = self._with_upcoming_shows().add_columns(
+          func.count().over().label('total')
+        ).filter(self.model.name.ilike(pattern)
+        ).order_by(func.similarity(self.model.name, literal(term)).desc(), self.model.name
+        ).limit(limit).all()
+      return {
+        "count": rows[0].total if rows else 0,
+        "data": [self._format(row) for row in rows]
+      }
+
+    count, top = self.index().search(term, limit)
+    rows = self._with_upcoming_shows().filter(self.model.id.in_(top)).all() if top else []
+    order = {id: position for position, id in enumerate(top)}
+    rows.sort(key=lambda row: order[row.id])
+    return {
+      "count": count,
+      "data": [self._format(row) for row in rows]
+    }
+
+  def autocomplete(self, prefix, limit=10):
+    '''Names starting with `prefix`, alphabetically.'''
+    limit = self.clamp(limit, 10)
+    prefix = prefix.strip()
+    if not prefix:
+      return []
+    if self.use_trigram_index():
+      rows = self.db.session.query(self.model.id, self.model.name
+        ).filter(self.model.name.ilike(escape_like(prefix) + '%')
+        ).order_by(func.lower(self.model.name), self.model.id
+        ).limit(limit).all()
+    else:
+      ids = self.index().prefix(prefix, limit)
+      names = dict(self.db.session.query(self.model.id, self.model.name
+        ).filter(self.model.id.in_(ids)).all()) if ids else {}
+      rows = [(id, names[id]) for id in ids if id in names]
+    return [{"id": id, "name": name} for id, name in rows]
+
+
+def enable_pg_trgm(metadata):
+  '''Create the pg_trgm extension before create_all() builds the indexes.'''
+  event.listen(metadata, 'before_create',
+               DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
@@ -0,0 +1,255 @@
+'''
+Bulk loading of venues, artists and shows, generated or read from
+CSV/NDJSON files (see `flask seed --help`).
+
+Rows are written in batches: on Postgres each batch is streamed with
+COPY ... FROM STDIN, elsewhere it is one executemany INSERT. Ids are
+assigned here (after the highest existing id) so that genre links and
+shows can refer to rows in the same load; on Postgres the id sequences are
+moved past them afterwards.
+'''
+import csv
+import io
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+import dateutil.parser
+import sqlalchemy as sa
+
+
+GENRES = [
+  'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+  'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+  'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+
+CITIES = [
+  ('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'),
+  ('Chicago', 'IL'), ('Seattle', 'WA'), ('Nashville', 'TN'),
+]
+
+
+class Progress:
+  '''Prints "<label>: <rows> rows, <rows/s> rows/s" at most every `interval` seconds, and when done.'''
+  def __init__(self, label, total=None, stream=sys.stderr, interval=1.0):
+    self.label = label
+    self.total = total
+    self.stream = stream
+    self.interval = interval
+    self.rows = 0
+    self.start = self.last = time.perf_counter()
+
+  def update(self, rows):
+    self.rows += rows
+    now = time.perf_counter()
+    if now - self.last >= self.interval:
+      self.last = now
+      self.report(now)
+
+  def report(self, now=None):
+    if self.stream is None:
+      return
+    elapsed = (now or time.perf_counter()) - self.start
+    of = ' of {:,}'.format(self.total) if self.total else ''
+    self.stream.write('{}: {:,}{} rows, {:,.0f} rows/s\n'.format(
+      self.label, self.rows, of, self.rows / elapsed if elapsed else 0))
+    self.stream.flush()
+
+  def done(self):
+    self.report()
+    return self.rows
+
+
+def batches(rows, size):
+  batch = []
+  for row in rows:
+    batch.append(row)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def csv_field(value):
+  # unquoted empty is NULL in COPY's csv format; everything else is quoted
+  # so that an empty string stays an empty string
+  if value is None:
+    return ''
+  if isinstance(value, datetime):
+    value = value.isoformat()
+  return '"' + str(value).replace('"', '""') + '"'
+
+
+def batch_columns(batch):
+  '''Every key used by the rows of `batch`, in order of first appearance.'''
+  return list(dict.fromkeys(key for row in batch for key in row))
+
+
+class BulkLoader:
+  def __init__(self, db, batch_size=10000, progress=sys.stderr):
+    self.db = db
+    self.batch_size = batch_size
+    self.progress = progress
+
+  @property
+  def use_copy(self):
+    return self.db.engine.dialect.name == 'postgresql'
+
+  def next_id(self, table):
+    return (self.db.session.query(sa.func.max(table.c.id)).scalar() or 0) + 1
+
+  def load(self, table, rows, total=None):
+    '''Write the `rows` dicts into `table` in batches, in one transaction. Returns the row count.'''
+    progress = Progress(table.name, total, self.progress)
+    with self.db.engine.begin() as connection:
+      for batch in batches(rows, self.batch_size):
+        # rows may not all have the same keys (NDJSON); a missing key is NULL on both paths
+        columns = batch_columns(batch)
+        if self.use_copy:
+          self._copy(connection, table, columns, batch)
+        else:
+          connection.execute(table.insert(),
+                             [{column: row.get(column) for column in columns} for row in batch])
+        progress.update(len(batch))
+    return progress.done()
+
+  def _copy(self, connection, table, columns, batch):
+    data = io.StringIO()
+    for row in batch:
+      data.write(','.join(csv_field(row.get(column)) for column in columns))
+      data.write('\n')
+    data.seek(0)
+    sql = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+      table.name, ', '.join('"{}"'.format(column) for column in columns))
+    cursor = connection.connection.cursor()
+    try:
+      cursor.copy_expert(sql, data)
+    finally:
+      cursor.close()
+
+  def reset_sequence(self, table):
+    '''Move the id sequence past ids we assigned ourselves (Postgres only).'''
+    if not self.use_copy:
+      return
+    self.db.session.execute(sa.text(
+      "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+      "(SELECT coalesce(max(id), 1) FROM \"{}\"))".format(table.name)),
+      {'table': '"{}"'.format(table.name)})
+    self.db.session.commit()
+
+  def genre_ids(self, genre_table, names):
+    '''Ids of the genres called `names`, inserting the ones that don't exist yet.'''
+    existing = dict(self.db.session.execute(
+      sa.select([genre_table.c.name, genre_table.c.id])).fetchall())
+    missing = sorted(set(names) - set(existing))
+    if missing:
+      self.db.session.execute(genre_table.insert(), [{'name': name} for name in missing])
+      self.db.session.commit()
+      existing = dict(self.db.session.execute(
+        sa.select([genre_table.c.name, genre_table.c.id])).fetchall())
+      self.reset_sequence(genre_table)
+    return existing
+
+
+def generate(loader, tables, venues, artists, shows, genres_per_row=2, now=None, rng=random):
+  '''
+  Synthetic data: `venues` venues and `artists` artists spread over CITIES,
+  each with `genres_per_row` genres, and `shows` shows between random
+  venues and artists within a year either side of `now`.
+  '''
+  now = now or datetime.now()
+  genre_ids = list(loader.genre_ids(tables['genres'], GENRES).values()) if genres_per_row else []
+  first_venue = loader.next_id(tables['venues'])
+  first_artist = loader.next_id(tables['artists'])
+  counts = {}
+
+  def people(kind, first, count):
+    for i in range(count):
+      city, state = CITIES[i % len(CITIES)]
+      yield {'id': first + i, 'name': '{} {}'.format(kind.title(), first + i),
+             'city': city, 'state': state}
+
+  def links(fk, first, count):
+    for i in range(count):
+      for genre_id in rng.sample(genre_ids, min(genres_per_row, len(genre_ids))):
+        yield {'genre_id': genre_id, fk: first + i}
+
+  counts['venues'] = loader.load(tables['venues'], people('venue', first_venue, venues), venues)
+  counts['artists'] = loader.load(tables['artists'], people('artist', first_artist, artists), artists)
+  if genre_ids:
+    loader.load(tables['venue_genres'], links('venue_id', first_venue, venues), venues * genres_per_row)
+    loader.load(tables['artist_genres'], links('artist_id', first_artist, artists), artists * genres_per_row)
+  if venues and artists:
+    counts['shows'] = loader.load(tables['shows'], ({
+      'venue_id': rng.randrange(first_venue, first_venue + venues),
+      'artist_id': rng.randrange(first_artist, first_artist + artists),
+      'start_time': now + timedelta(minutes=rng.randint(-525600, 525600)),
+    } for _ in range(shows)), shows)
+  for kind in ('venues', 'artists', 'shows'):
+    loader.reset_sequence(tables[kind])
+  return counts
+
+
+def read_rows(path):
+  '''Dicts from a CSV file with a header row, or from NDJSON (.ndjson/.jsonl/.json).'''
+  if path.endswith(('.ndjson', '.jsonl', '.json')):
+    with open(path) as f:
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+  else:
+    with open(path, newline='') as f:
+      yield from csv.DictReader(f)
+
+
+def coerce(table, row):
+  '''Convert file values to the column types; unknown keys are dropped, '' is NULL.'''
+  values = {}
+  for column in table.columns:
+    if column.name not in row:
+      continue
+    value = row[column.name]
+    if value == '' or value is None:
+      value = None
+    elif isinstance(column.type, sa.DateTime) and not isinstance(value, datetime):
+      value = dateutil.parser.parse(value)
+    elif isinstance(column.type, sa.Integer):
+      value = int(value)
+    values[column.name] = value
+  return values
+
+
+def ingest(loader, tables, kind, path):
+  '''
+  Load venues, artists or shows from `path`. Rows without an id get the
+  next free ones. A `genres` field (a list, or names separated by commas)
+  on venues and artists is stored as genre links.
+  '''
+  table = tables[kind]
+  link_table, fk = {'venues': ('venue_genres', 'venue_id'),
+                    'artists': ('artist_genres', 'artist_id')}.get(kind, (None, None))
+  next_id = [loader.next_id(table)]
+  genre_links = []
+
+  def rows():
+    for row in read_rows(path):
+      values = coerce(table, row)
+      if values.get('id') is None:
+        values['id'] = next_id[0]
+      next_id[0] = max(next_id[0], values['id'] + 1)
+      genres = row.get('genres')
+      if link_table and genres:
+        names = genres if isinstance(genres, list) else genres.split(',')
+        genre_links.extend((values['id'], name.strip()) for name in names if name.strip())
+      yield values
+
+  count = loader.load(table, rows())
+  if genre_links:
+    ids = loader.genre_ids(tables['genres'], {name for _, name in genre_links})
+    loader.load(tables[link_table], (
+      {'genre_id': ids[name], fk: owner} for owner, name in genre_links), len(genre_links))
+  loader.reset_sequence(table)
+  return count
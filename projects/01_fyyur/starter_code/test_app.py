@@ -0,0 +1,221 @@
+import os
+import base64
+import json
+import logging
+import queue
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+# config.py reads DATABASE_URL when app is imported, and the tests drop every
+# table: never let them near the database the app is configured with
+os.environ['DATABASE_URL'] = os.environ.get(
+    'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fyyur_test.db'))
+
+import app as fyyur
+from pagination import encode_cursor, decode_cursor
+from logging_pipeline import DroppingQueueHandler
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the Fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and start from empty tables."""
+        self.app = fyyur.app
+        self.client = self.app.test_client
+        self.db = fyyur.db
+        self.db.session.remove()
+        self.db.drop_all()
+        self.db.create_all()
+        fyyur.fragment_cache.clear()
+        fyyur.venue_search.invalidate()
+        fyyur.artist_search.invalidate()
+
+    def tearDown(self):
+        self.db.session.remove()
+
+    def add_artist(self, name='The Artist', phone='555-0100'):
+        artist = fyyur.Artist(name=name, city='San Francisco', state='CA', phone=phone)
+        self.db.session.add(artist)
+        self.db.session.commit()
+        return artist.id
+
+    def artists_page(self, query_string):
+        with self.app.test_request_context('/artists?' + query_string):
+            page = fyyur.artists_page()
+            return [artist['id'] for artist in page], page.prev, page.next
+
+    def add_shows(self, count):
+        venue = fyyur.Venue(name='The Venue', city='San Francisco', state='CA')
+        artist = fyyur.Artist(name='The Artist', city='San Francisco', state='CA')
+        start = datetime(2030, 1, 1)
+        self.db.session.add_all([venue, artist] + [
+            fyyur.Show(venue=venue, artist=artist, start_time=start + timedelta(hours=i // 2))
+            for i in range(count)])
+        self.db.session.commit()
+
+    def test_decode_cursor_round_trip(self):
+        columns = (fyyur.Show.start_time, fyyur.Show.id)
+        values = [datetime(2030, 1, 1, 20, 30), 7]
+
+        self.assertEqual(decode_cursor(encode_cursor(values), columns), values)
+
+    def test_decode_cursor_rejects_values_of_the_wrong_type(self):
+        columns = (fyyur.Show.start_time, fyyur.Show.id)
+        for values in ([1, 2], ['2030-01-01T00:00:00', {'a': 1}], ['2030-01-01T00:00:00', '7'],
+                       ['2030-01-01T00:00:00', True], ['next week', 7], [None, 7],
+                       ['2030-01-01T00:00:00'], {'start_time': '2030-01-01T00:00:00'}):
+            with self.assertRaises(ValueError):
+                decode_cursor(raw_cursor(values), columns)
+
+    def test_400_shows_with_malformed_cursor(self):
+        self.add_shows(3)
+        for cursor in (raw_cursor([1, 2]), raw_cursor(['2030-01-01T00:00:00', {'a': 1}]),
+                       raw_cursor('2030-01-01T00:00:00'), 'not-a-cursor!'):
+            for direction in ('after', 'before'):
+                res = self.client().get('/shows?{}={}'.format(direction, cursor))
+
+                self.assertEqual(res.status_code, 400)
+
+    def test_400_artists_with_malformed_cursor(self):
+        res = self.client().get('/artists?after=' + raw_cursor([1, 'The Artist']))
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_search_follows_commits_not_rollbacks(self):
+        self.db.session.add(fyyur.Venue(name='Blue Note', city='New York', state='NY'))
+        self.db.session.commit()
+        self.assertEqual(fyyur.venue_search.search('blue')['count'], 1)
+
+        self.db.session.add(fyyur.Venue(name='Blue Room', city='New York', state='NY'))
+        self.db.session.flush()
+        fyyur.venue_search.search('blue')
+        self.db.session.rollback()
+        self.assertEqual(fyyur.venue_search.search('blue')['count'], 1)
+
+        self.db.session.add(fyyur.Venue(name='Blue Room', city='New York', state='NY'))
+        self.db.session.commit()
+        self.assertEqual(fyyur.venue_search.search('blue')['count'], 2)
+
+    def test_edit_artist(self):
+        artist_id = self.add_artist()
+        res = self.client().post('/artists/{}/edit'.format(artist_id),
+                                 data={'name': 'The Artists', 'version': 1})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(fyyur.Artist.query.get(artist_id).name, 'The Artists')
+        self.assertEqual(fyyur.Artist.query.get(artist_id).version_id, 2)
+
+    def test_409_edit_artist_with_stale_version(self):
+        artist_id = self.add_artist()
+        self.client().post('/artists/{}/edit'.format(artist_id),
+                           data={'name': 'The Artists', 'version': 1})
+        res = self.client().post('/artists/{}/edit'.format(artist_id),
+                                 data={'name': 'Someone Else', 'version': 1})
+
+        self.assertEqual(res.status_code, 409)
+        self.assertIn('changed by someone else', res.data.decode())
+        self.assertEqual(fyyur.Artist.query.get(artist_id).name, 'The Artists')
+
+    def test_409_edit_venue_with_stale_version(self):
+        venue = fyyur.Venue(name='The Venue', city='San Francisco', state='CA')
+        self.db.session.add(venue)
+        self.db.session.commit()
+        venue_id = venue.id
+        self.client().post('/venues/{}/edit'.format(venue_id), data={'name': 'Venue A', 'version': 1})
+        res = self.client().post('/venues/{}/edit'.format(venue_id), data={'name': 'Venue B', 'version': 1})
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(fyyur.Venue.query.get(venue_id).name, 'Venue A')
+
+    def test_400_edit_artist_without_version(self):
+        artist_id = self.add_artist()
+        res = self.client().post('/artists/{}/edit'.format(artist_id), data={'name': 'The Artists'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(fyyur.Artist.query.get(artist_id).name, 'The Artist')
+
+    def test_artist_pages_cover_every_row_once(self):
+        # repeated names: the id in the cursor breaks the ties
+        expected = [self.add_artist(name='Artist {}'.format(i % 7)) for i in range(45)]
+        expected.sort(key=lambda id: (fyyur.Artist.query.get(id).name, id))
+
+        seen, next = [], {}
+        while next is not None:
+            ids, prev, next = self.artists_page('per_page=10&after=' + next.get('after', ''))
+            seen += ids
+        self.assertEqual(seen, expected)
+
+        # and back again from the last page
+        seen = ids
+        while prev is not None:
+            ids, prev, next = self.artists_page('per_page=10&before=' + prev['before'])
+            seen = ids + seen
+        self.assertEqual(seen, expected)
+
+    def test_cached_artist_page_changes_after_a_write(self):
+        artist_id = self.add_artist()
+        self.client().get('/artists/{}'.format(artist_id))
+        res = self.client().get('/artists/{}'.format(artist_id))
+        self.assertIn('555-0100', res.data.decode())
+        self.assertEqual(fyyur.fragment_cache.hits, 1)
+
+        fyyur.Artist.query.get(artist_id).phone = '555-0199'
+        self.db.session.commit()
+        res = self.client().get('/artists/{}'.format(artist_id))
+        self.assertIn('555-0199', res.data.decode())
+
+        venue = fyyur.Venue(name='The Venue', city='San Francisco', state='CA')
+        self.db.session.add(fyyur.Show(venue=venue, artist_id=artist_id,
+                                       start_time=datetime.now() + timedelta(days=1)))
+        self.db.session.commit()
+        res = self.client().get('/artists/{}'.format(artist_id))
+        self.assertIn('The Venue', res.data.decode())
+
+    def test_cached_shows_page_changes_after_a_write(self):
+        self.add_shows(1)
+        self.client().get('/shows')
+        fyyur.Venue.query.first().name = 'Renamed Venue'
+        self.db.session.commit()
+        res = self.client().get('/shows')
+
+        self.assertIn('Renamed Venue', res.data.decode())
+
+    def test_seed_load_ndjson_rows_with_different_keys(self):
+        path = os.path.join(tempfile.mkdtemp(), 'venues.ndjson')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'name': 'Venue A', 'city': 'Austin'}) + '\n')
+            f.write(json.dumps({'name': 'Venue B', 'state': 'TX', 'genres': 'Jazz, Folk'}) + '\n')
+        result = self.app.test_cli_runner().invoke(args=['seed', 'load', 'venues', path])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        venues = {venue.name: venue for venue in fyyur.Venue.query}
+        self.assertEqual((venues['Venue A'].city, venues['Venue A'].state), ('Austin', None))
+        self.assertEqual((venues['Venue B'].city, venues['Venue B'].state), (None, 'TX'))
+        self.assertEqual([genre.name for genre in venues['Venue B'].genres], ['Folk', 'Jazz'])
+
+    def test_logging_queue_drops_newest_when_full(self):
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1), 'newest')
+        for message in ('first', 'second', 'third'):
+            handler.handle(logging.makeLogRecord({'msg': message, 'levelname': 'INFO'}))
+
+        self.assertEqual(handler.queue.get_nowait().msg, 'first')
+        self.assertEqual((handler.enqueued, handler.dropped), (1, {'INFO': 2}))
+
+    def test_logging_queue_drops_oldest_when_full(self):
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1), 'oldest')
+        for message in ('first', 'second', 'third'):
+            handler.handle(logging.makeLogRecord({'msg': message, 'levelname': 'INFO'}))
+
+        self.assertEqual(handler.queue.get_nowait().msg, 'third')
+        self.assertEqual((handler.enqueued, handler.dropped), (3, {'INFO': 2}))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
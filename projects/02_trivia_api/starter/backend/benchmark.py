@@ -0,0 +1,222 @@
+'''
+Benchmarks for the trivia API.
+
+Each benchmark seeds a throwaway database (sqlite unless --database-url is
+given) with --sizes questions spread over the six categories and reports,
+per size, the number of SQL statements and the time a request takes:
+
+    python benchmark.py quiz --sizes 1000 100000 1000000 --excluded 0 100 500
+    python benchmark.py listing --sizes 1000 100000 1000000
+
+Seeding drops and recreates the tables, so a --database-url whose tables
+already hold rows is refused unless --reset is given.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+
+
+def load_app(database_url):
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    from flaskr import create_app
+    return create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+
+
+class QueryCounter:
+    '''counts the statements executed on `engine` inside the with block.'''
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def holds_rows(db):
+    '''whether any of the models' tables already exists with rows in it.'''
+    from sqlalchemy import inspect
+    existing = set(inspect(db.engine).get_table_names())
+    return any(db.session.execute(table.select().limit(1)).first() is not None
+               for table in db.metadata.sorted_tables if table.name in existing)
+
+
+def seed(app, db, questions, batch_size=10000):
+    from models import Question, Category
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Category.__table__.insert(), [{'type': type} for type in CATEGORIES])
+    for start in range(0, questions, batch_size):
+        db.session.execute(Question.__table__.insert(), [{
+            'question': 'Question {}?'.format(i),
+            'answer': 'Answer {}'.format(i),
+            'category': i % len(CATEGORIES) + 1,
+            'difficulty': i % 5 + 1
+        } for i in range(start, min(start + batch_size, questions))])
+    db.session.commit()
+    # core inserts bypass the orm events the caches follow
+    app.extensions['quiz_pool'].invalidate()
+    app.extensions['category_cache'].invalidate()
+
+
+def timed(fn, repeat, engine):
+    with QueryCounter(engine) as counter:
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'queries': counter.count,
+        'p50_ms': round(1000 * timings[len(timings) // 2], 3),
+        'max_ms': round(1000 * timings[-1], 3)
+    }
+
+
+def naive_quiz_question(category, previous):
+    # loads every question in the category and filters in python, as a
+    # straightforward implementation of the quiz endpoint would
+    from models import Question
+    query = Question.query
+    if category:
+        query = query.filter(Question.category == category)
+    remaining = [q for q in query.all() if q.id not in previous]
+    return random.choice(remaining).format() if remaining else None
+
+
+def bench_quiz(app, db, args):
+    '''
+    POST /quizzes for one category, --excluded questions into a quiz:
+    sending the previous questions, continuing a server-side session, and
+    the load-everything baseline.
+
+    every timed session request continues a session of its own, freshly
+    taken --excluded questions in, so each repeat times the same draw.
+    an --excluded that leaves no question in the category is skipped.
+    '''
+    from models import Question
+    client = app.test_client()
+    category = {'type': 'Science', 'id': 1}
+
+    def start_session(excluded):
+        # the request starting a quiz draws its first question
+        if not excluded:
+            return {'quiz_category': category}
+        session_id = client.post('/quizzes', json={'quiz_category': category}).get_json()['quiz_session']
+        for _ in range(excluded - 1):
+            client.post('/quizzes', json={'quiz_session': session_id})
+        return {'quiz_session': session_id}
+
+    results = []
+    for size in args.sizes:
+        seed(app, db, size)
+        ids = [id for id, in db.session.query(Question.id).filter(Question.category == 1)]
+        # load the category's ids into the pool outside the timings
+        app.extensions['quiz_pool'].ids(1)
+        for excluded in args.excluded:
+            if excluded >= len(ids):
+                print('skipping --excluded {} at {} questions: the category only has {}'.format(
+                    excluded, size, len(ids)), file=sys.stderr)
+                continue
+            previous = random.sample(ids, excluded)
+            stateless = {'previous_questions': previous, 'quiz_category': category}
+            # timed() makes repeat + 1 requests, one per session
+            sessions = [start_session(excluded) for _ in range(args.repeat + 1)]
+            variants = [
+                ('previous_questions', stateless, lambda: client.post('/quizzes', json=stateless).get_data()),
+                ('session', sessions[0], lambda: client.post('/quizzes', json=sessions.pop()).get_data()),
+            ]
+            if size <= args.naive_limit:
+                previous_set = set(previous)
+                variants.append(('naive', stateless, lambda: naive_quiz_question(1, previous_set)))
+            for name, body, fn in variants:
+                result = timed(fn, args.repeat, db.engine)
+                result.update(questions=size, excluded=excluded, method=name,
+                              request_bytes=len(json.dumps(body)))
+                results.append(result)
+            db.session.remove()
+    return results
+
+
+def bench_listing(app, db, args):
+    '''
+    GET /questions and /categories/<id>/questions, first and last page,
+    with the category cache warm and with it reloaded on every request.
+    '''
+    client = app.test_client()
+    cache = app.extensions['category_cache']
+    results = []
+    for size in args.sizes:
+        seed(app, db, size)
+        last = size // len(CATEGORIES) // 10
+        for path in ('/questions', '/questions?page={}'.format(size // 10),
+                     '/categories/1/questions', '/categories/1/questions?page={}'.format(last)):
+            for name, before in (('cached', lambda: None), ('reloaded', cache.invalidate)):
+                def fn():
+                    before()
+                    client.get(path).get_data()
+                fn()
+                result = timed(fn, args.repeat, db.engine)
+                result.update(questions=size, path=path, categories=name)
+                results.append(result)
+    return results
+
+
+BENCHMARKS = {
+    'listing': (bench_listing, 'GET /questions and /categories/<id>/questions with the category cache'),
+    'quiz': (bench_quiz, 'POST /quizzes: next random question in a category, --excluded questions in'),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--excluded', type=int, nargs='+', default=[0, 100, 500],
+                        help='questions already asked in the quiz')
+    parser.add_argument('--naive-limit', type=int, default=1000000,
+                        help='largest size to also time the load-everything baseline at')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database-url')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop the tables of --database-url even if they hold rows')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    app = load_app(args.database_url)
+    from models import db
+    run, description = BENCHMARKS[args.benchmark]
+    print(description)
+    with app.app_context():
+        # every size reseeds from scratch: only wipe a database we created or were told to
+        if args.database_url and not args.reset and holds_rows(db):
+            sys.exit('--database-url already holds rows: pass --reset to drop its tables')
+        results = run(app, db, args)
+
+    for result in results:
+        print('  ' + '  '.join('{}={}'.format(key, value) for key, value in result.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': args.benchmark, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
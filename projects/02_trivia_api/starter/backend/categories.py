@@ -0,0 +1,148 @@
+import threading
+import time
+from sqlalchemy import func
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+
+from listeners import listen
+
+
+'''
+CategoryCache
+    the categories ({id: type}) and the number of questions in each,
+    loaded once instead of on every request.
+
+    question counts follow inserts, deletes and category changes made
+    through the ORM: each flush records +1/-1 per category in the session,
+    applied when the session commits and dropped if it rolls back. a change
+    to a category itself, or invalidate(), makes the next use reload
+    everything; so does `ttl` seconds passing, which bounds the drift from
+    writes this process can't see (other processes, bulk sql).
+'''
+class CategoryCache:
+    def __init__(self, db, category, question, ttl=300, clock=time.monotonic):
+        self.db = db
+        self.category = category
+        self.question = question
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.loads = 0
+        self.invalidations = 0
+        self._types = None
+        self._counts = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def _state(self):
+        with self._lock:
+            if self._types is None or self.clock() >= self._expires:
+                self._load()
+            else:
+                self.hits += 1
+            return self._types, self._counts
+
+    def _load(self):
+        session = self.db.session
+        self._types = {id: type for id, type in session.query(
+            self.category.id, self.category.type).order_by(self.category.id)}
+        self._counts = dict(session.query(
+            self.question.category, func.count()).group_by(self.question.category))
+        self._expires = self.clock() + self.ttl
+        self.loads += 1
+
+    def load(self):
+        with self._lock:
+            self._load()
+
+    def types(self):
+        '''{id: type} for every category, in id order.'''
+        return dict(self._state()[0])
+
+    def type(self, id):
+        '''the category's type, or None if there is no such category.'''
+        return self._state()[0].get(id)
+
+    def count(self, category=None):
+        '''questions in `category`, or in all categories (and none) if not given.'''
+        counts = self._state()[1]
+        if category is None:
+            return sum(counts.values())
+        return counts.get(category, 0)
+
+    def invalidate(self):
+        with self._lock:
+            self._types = self._counts = None
+            self.invalidations += 1
+
+    def _apply(self, deltas):
+        with self._lock:
+            if self._counts is None:
+                return
+            for category, delta in deltas.items():
+                self._counts[category] = self._counts.get(category, 0) + delta
+
+    def stats(self):
+        return {
+            'loaded': self._types is not None,
+            'categories': len(self._types or ()),
+            'questions': sum((self._counts or {}).values()),
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'loads': self.loads,
+            'invalidations': self.invalidations
+        }
+
+    def watch(self, session):
+        '''keep the cache current with the question and category changes committed through `session`.'''
+        listen(self.question, 'after_insert', self, CategoryCache._question_inserted)
+        listen(self.question, 'after_delete', self, CategoryCache._question_deleted)
+        listen(self.question, 'after_update', self, CategoryCache._question_updated)
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            listen(self.category, name, self, CategoryCache._category_changed)
+        listen(session, 'after_commit', self, CategoryCache._after_commit)
+        listen(session, 'after_rollback', self, CategoryCache._after_rollback)
+
+    # pending changes are keyed by the cache, as several apps (in tests) can share a session
+
+    def _record(self, target, deltas):
+        session = object_session(target)
+        if session is not None:
+            pending = session.info.setdefault((self, 'deltas'), {})
+            for category, delta in deltas:
+                pending[category] = pending.get(category, 0) + delta
+
+    def _mark_stale(self, target):
+        session = object_session(target)
+        if session is not None:
+            session.info[(self, 'stale')] = True
+
+    def _question_inserted(self, mapper, connection, target):
+        self._record(target, [(target.category, 1)])
+
+    def _question_deleted(self, mapper, connection, target):
+        self._record(target, [(target.category, -1)])
+
+    def _question_updated(self, mapper, connection, target):
+        history = get_history(target, 'category')
+        if not history.has_changes():
+            return
+        if history.deleted:
+            self._record(target, [(history.deleted[0], -1), (history.added[0], 1)])
+        else:
+            # the old category was never loaded, so we can't tell which count to lower
+            self._mark_stale(target)
+
+    def _category_changed(self, mapper, connection, target):
+        self._mark_stale(target)
+
+    def _after_commit(self, session):
+        deltas = session.info.pop((self, 'deltas'), None)
+        if session.info.pop((self, 'stale'), False):
+            self.invalidate()
+        elif deltas:
+            self._apply(deltas)
+
+    def _after_rollback(self, session):
+        session.info.pop((self, 'deltas'), None)
+        session.info.pop((self, 'stale'), None)
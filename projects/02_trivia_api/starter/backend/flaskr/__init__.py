@@ -4,14 +4,35 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
+from instrumentation import Instrumentation
+from quiz import question_pool, QuizSession, MemorySessionStore
+from search import QuestionSearch
+from categories import CategoryCache
 
 QUESTIONS_PER_PAGE = 10
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  if test_config and 'SQLALCHEMY_DATABASE_URI' in test_config:
+    setup_db(app, test_config['SQLALCHEMY_DATABASE_URI'])
+  else:
+    setup_db(app)
+  # /metrics and /internal/* carry no auth; they are only served when the
+  # deployment opts in, e.g. behind a private network
+  internal_endpoints = (test_config or {}).get('INTERNAL_ENDPOINTS',
+    os.environ.get('ENABLE_INTERNAL_ENDPOINTS', 'false').lower() == 'true')
+  Instrumentation(app, db, path='/metrics' if internal_endpoints else None)
+  question_search = app.extensions['question_search'] = QuestionSearch(db, Question)
+  category_cache = app.extensions['category_cache'] = CategoryCache(db, Category, Question)
+  category_cache.watch(db.session)
+  with app.app_context():
+    question_search.create_indexes()
+    category_cache.load()
+  quiz_pool = app.extensions['quiz_pool'] = question_pool(db, Question)
+  quiz_sessions = app.extensions['quiz_sessions'] = (
+    (test_config or {}).get('QUIZ_SESSION_STORE') or MemorySessionStore())
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -22,24 +43,38 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests 
-  for all available categories.
+  GET '/categories'
+      {"categories": {id: type}}, from the category cache.
   '''
-
+  @app.route('/categories')
+  def get_categories():
+    return jsonify({
+      'success': True,
+      'categories': category_cache.types()
+    })
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests for questions, 
-  including pagination (every 10 questions). 
-  This endpoint should return a list of questions, 
-  number of total questions, current category, categories. 
-
-  TEST: At this point, when you start the application
-  you should see questions and categories generated,
-  ten questions per page and pagination at the bottom of the screen for three pages.
-  Clicking on the page numbers should update the questions. 
+  GET '/questions?page=1'
+      all questions in id order, QUESTIONS_PER_PAGE at a time, with the
+      categories and the total from the category cache.
   '''
+  @app.route('/questions')
+  def get_questions():
+    page = max(request.args.get('page', 1, type=int), 1)
+    questions = Question.query.order_by(Question.id).offset(
+      (page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE).all()
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in questions],
+      'total_questions': category_cache.count(),
+      'categories': category_cache.types(),
+      'current_category': None
+    })
+
+  if internal_endpoints:
+    @app.route('/internal/category-cache')
+    def category_cache_stats():
+      return jsonify(category_cache.stats())
 
   '''
   @TODO: 
@@ -61,37 +96,107 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create a POST endpoint to get questions based on a search term. 
-  It should return any questions for whom the search term 
-  is a substring of the question. 
-
-  TEST: Search by any phrase. The questions list will update to include 
-  only question that include that string within their question. 
-  Try using the word "title" to start. 
-  '''
-
-  '''
-  @TODO: 
-  Create a GET endpoint to get questions based on category. 
-
-  TEST: In the "List" tab / main screen, clicking on one of the 
-  categories in the left column will cause only questions of that 
-  category to be shown. 
-  '''
-
-
-  '''
-  @TODO: 
-  Create a POST endpoint to get questions to play the quiz. 
-  This endpoint should take category and previous question parameters 
-  and return a random questions within the given category, 
-  if provided, and that is not one of the previous questions. 
-
-  TEST: In the "Play" tab, after a user selects "All" or a category,
-  one question at a time is displayed, the user is allowed to answer
-  and shown whether they were correct or not. 
-  '''
+  POST '/questions/search'
+      {"searchTerm": ..., "page": 1}
+      questions containing the words of searchTerm, best matches first,
+      then questions containing it as a substring, QUESTIONS_PER_PAGE at a
+      time. each question has `highlight` with its question and answer as
+      html, the matches wrapped in <mark>.
+  '''
+  @app.route('/questions/search', methods=['POST'])
+  def search_questions():
+    body = request.get_json(silent=True) or {}
+    term = body.get('searchTerm')
+    if term is not None and not isinstance(term, str):
+      abort(400)
+    try:
+      page = max(int(body.get('page') or request.args.get('page') or 1), 1)
+    except (TypeError, ValueError):
+      abort(400)
+
+    total, results = question_search.search(term, page, QUESTIONS_PER_PAGE)
+    questions = []
+    for question, question_html, answer_html in results:
+      formatted = question.format()
+      formatted['highlight'] = {'question': question_html, 'answer': answer_html}
+      questions.append(formatted)
+    return jsonify({
+      'success': True,
+      'questions': questions,
+      'total_questions': total,
+      'current_category': None,
+      'page': page
+    })
+
+  '''
+  GET '/categories/<id>/questions?page=1'
+      the category's questions in id order, QUESTIONS_PER_PAGE at a time,
+      read from the (category, id) index, with the category's type and
+      question count from the category cache; 404 for an unknown category.
+  '''
+  @app.route('/categories/<int:category_id>/questions')
+  def category_questions(category_id):
+    category_type = category_cache.type(category_id)
+    if category_type is None:
+      abort(404)
+    page = max(request.args.get('page', 1, type=int), 1)
+    questions = Question.query.filter(Question.category == category_id).order_by(
+      Question.id).offset((page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE).all()
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in questions],
+      'total_questions': category_cache.count(category_id),
+      'categories': category_cache.types(),
+      'current_category': category_type
+    })
+
+
+  '''
+  POST '/quizzes'
+      starts a quiz with {"quiz_category": {"type": ..., "id": ...}} (id 0
+      for all categories), then continues it with {"quiz_session": id}.
+      returns the next question, in random order without repeats, or null
+      once the category is used up, and the quiz_session id to send next.
+      previous_questions, if sent when starting a quiz, are skipped.
+      an unknown or expired quiz_session is a 404, one that isn't a string
+      a 400.
+  '''
+  @app.route('/quizzes', methods=['POST'])
+  def play_quiz():
+    body = request.get_json(silent=True) or {}
+    session_id = body.get('quiz_session')
+    if session_id is not None and not isinstance(session_id, str):
+      abort(400)
+    if session_id:
+      session = quiz_sessions.get(session_id)
+      if session is None:
+        abort(404)
+    else:
+      try:
+        previous = [int(id) for id in body.get('previous_questions') or []]
+        category = int((body.get('quiz_category') or {}).get('id') or 0)
+      except (TypeError, ValueError, AttributeError):
+        abort(400)
+      session = QuizSession(category, quiz_pool.ids(category), skip=previous)
+
+    question = None
+    with session.lock:
+      while question is None:
+        id = session.next()
+        if id is None:
+          break
+        # None if deleted since the session started
+        question = Question.query.get(id)
+
+      if question is None:
+        quiz_sessions.delete(session.id)
+      else:
+        quiz_sessions.put(session)
+    return jsonify({
+      'success': True,
+      'question': question.format() if question else None,
+      'quiz_session': session.id
+    })
 
   '''
   @TODO: 
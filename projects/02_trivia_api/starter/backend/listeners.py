@@ -0,0 +1,32 @@
+import threading
+import weakref
+from sqlalchemy import event
+
+
+'''
+listen(target, name, owner, handler)
+    calls handler(owner, *args) on the sqlalchemy event `name` of `target`
+    (a model or a session) for as long as `owner` is alive.
+
+    sqlalchemy keeps a listener until it is removed, and each create_app()
+    builds its own caches on the same models and session; listening
+    directly would add listeners with every app and keep every old cache
+    alive. instead each (target, name) gets a single listener, added the
+    first time it is asked for, which calls the handlers of the owners
+    still alive. owners are held weakly, so they go away with their app.
+'''
+_owners = {}
+_lock = threading.Lock()
+
+def listen(target, name, owner, handler):
+    with _lock:
+        owners = _owners.get((target, name))
+        if owners is None:
+            owners = _owners[(target, name)] = weakref.WeakKeyDictionary()
+            event.listen(target, name, lambda *args: _dispatch(owners, args))
+        owners.setdefault(owner, []).append(handler)
+
+def _dispatch(owners, args):
+    for owner, handlers in list(owners.items()):
+        for handler in handlers:
+            handler(owner, *args)
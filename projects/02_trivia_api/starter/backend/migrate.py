@@ -0,0 +1,75 @@
+'''
+Brings an existing trivia database up to the current models:
+
+    python migrate.py [database url]
+
+Question.category is an integer foreign key to categories.id with an
+index on (category, id). Databases restored from an older trivia.psql
+already have the integer column and the foreign key but no index;
+databases created by db.create_all() from older models have a varchar
+column. Each step checks what is already there, so running this again is
+harmless. Postgres only: sqlite databases are throwaway, recreate them.
+'''
+import sys
+from sqlalchemy import create_engine, text
+
+from models import database_path
+
+
+def column_type(connection, table, column):
+    return connection.execute(text(
+        'SELECT data_type FROM information_schema.columns '
+        'WHERE table_name = :table AND column_name = :column'
+    ), table=table, column=column).scalar()
+
+def has_foreign_key(connection, table, column):
+    return connection.execute(text('''
+        SELECT 1 FROM information_schema.key_column_usage k
+        JOIN information_schema.table_constraints c USING (constraint_schema, constraint_name)
+        WHERE c.constraint_type = 'FOREIGN KEY' AND k.table_name = :table AND k.column_name = :column
+    '''), table=table, column=column).first() is not None
+
+
+def upgrade(connection, log=print):
+    if column_type(connection, 'questions', 'category') != 'integer':
+        # categories stored by name instead of id
+        converted = connection.execute(text('''
+            UPDATE questions q SET category = c.id::text FROM categories c
+            WHERE lower(trim(q.category)) = lower(c.type)
+        ''')).rowcount
+        invalid = connection.execute(text(r'''
+            UPDATE questions SET category = NULL
+            WHERE category IS NOT NULL AND category !~ '^\s*\d+\s*$'
+        ''')).rowcount
+        connection.execute(text(
+            'ALTER TABLE questions ALTER COLUMN category TYPE integer USING trim(category)::integer'))
+        log('questions.category: varchar -> integer ({} named categories converted, '
+            '{} unreadable set to NULL)'.format(converted, invalid))
+
+    if not has_foreign_key(connection, 'questions', 'category'):
+        orphans = connection.execute(text('''
+            UPDATE questions SET category = NULL
+            WHERE category IS NOT NULL AND category NOT IN (SELECT id FROM categories)
+        ''')).rowcount
+        connection.execute(text('''
+            ALTER TABLE questions ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+            REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL
+        '''))
+        log('questions.category: foreign key added ({} unknown categories set to NULL)'.format(orphans))
+
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id)'))
+    log('questions.category: indexed')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    engine = create_engine(argv[0] if argv else database_path)
+    if engine.dialect.name != 'postgresql':
+        sys.exit('migrate.py only upgrades postgres databases')
+    with engine.begin() as connection:
+        upgrade(connection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.orm import object_session
+
+from listeners import listen
+
+
+ALL_CATEGORIES = 0
+
+
+'''
+QuestionPool
+    the question ids of each category (and of all questions, under
+    ALL_CATEGORIES), read once into a compact array so that quiz sessions
+    can draw from them without loading the category's questions on every
+    request.
+
+    watch() drops a category's array once a transaction that inserts,
+    deletes or moves a question in it commits, so the next session reloads
+    it; sessions already running keep the array they started with.
+'''
+class QuestionPool:
+    def __init__(self, load_ids):
+        self.load_ids = load_ids
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def ids(self, category):
+        ids = self._ids.get(category)
+        if ids is None:
+            with self._lock:
+                ids = self._ids.get(category)
+                if ids is None:
+                    ids = self._ids[category] = array('q', self.load_ids(category))
+        return ids
+
+    def invalidate(self, *categories):
+        with self._lock:
+            if categories:
+                for category in categories + (ALL_CATEGORIES,):
+                    self._ids.pop(category, None)
+            else:
+                self._ids.clear()
+
+    def watch(self, model, category_key, session):
+        '''invalidate on changes to `model` rows committed through `session`; `category_key(row)` is the row's pool key.'''
+        self._category_key = category_key
+        listen(model, 'after_insert', self, QuestionPool._changed)
+        listen(model, 'after_delete', self, QuestionPool._changed)
+        listen(model, 'after_update', self, QuestionPool._updated)
+        listen(session, 'after_commit', self, QuestionPool._after_commit)
+        listen(session, 'after_rollback', self, QuestionPool._after_rollback)
+
+    # keyed by the pool, as several apps (in tests) can share a session.
+    # invalidating at flush would let a request reload the ids before the
+    # commit and keep the old ones until the next write
+    def _record(self, target, category):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault((self, 'pending'), set()).add(category)
+
+    def _changed(self, mapper, connection, target):
+        self._record(target, self._category_key(target))
+
+    def _updated(self, mapper, connection, target):
+        # the category itself may have changed
+        self._record(target, None)
+
+    def _after_commit(self, session):
+        categories = session.info.pop((self, 'pending'), None)
+        if categories is None:
+            return
+        if None in categories:
+            self.invalidate()
+        else:
+            self.invalidate(*categories)
+
+    def _after_rollback(self, session):
+        session.info.pop((self, 'pending'), None)
+
+
+'''
+question_pool(db, question)
+    a QuestionPool over the `question` model's ids, by category.
+'''
+def question_pool(db, question):
+    def load_ids(category):
+        query = select([question.id])
+        if category != ALL_CATEGORIES:
+            query = query.where(question.category == category)
+        return [id for id, in db.session.execute(query)]
+
+    pool = QuestionPool(load_ids)
+    pool.watch(question, lambda row: row.category or ALL_CATEGORIES, db.session)
+    return pool
+
+
+'''
+QuizSession
+    one player's run through a category: its question ids in random
+    order, handed out one at a time by next().
+
+    the order is a Fisher-Yates shuffle done lazily, swapping a random
+    remaining position into place on each draw and keeping only the
+    displaced ids in a dict. starting a session and each draw are O(1)
+    whatever the size of the category, and the pool's id array is shared
+    rather than copied. ids in `skip` (questions a client says it has
+    already seen) are passed over.
+
+    `lock` serializes the draws of concurrent requests on one session, so
+    they can't hand out the same question; it is not part of the state a
+    store serializes.
+'''
+class QuizSession:
+    def __init__(self, category, ids, skip=(), id=None):
+        self.id = id or secrets.token_urlsafe(16)
+        self.category = category
+        self.ids = ids
+        self.skip = set(skip)
+        self.position = 0
+        self.swaps = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def next(self, rng=random):
+        '''the next question id, or None when the category is used up.'''
+        ids, swaps = self.ids, self.swaps
+        while self.position < len(ids):
+            i = self.position
+            j = rng.randrange(i, len(ids))
+            picked = swaps.get(j, ids[j])
+            if j != i:
+                swaps[j] = swaps.pop(i, ids[i])
+            else:
+                swaps.pop(i, None)
+            self.position += 1
+            if picked not in self.skip:
+                return picked
+        return None
+
+
+'''
+SessionStore
+    where quiz sessions live between requests. get() returns None for an
+    unknown or expired session; put() is called after every draw, so a
+    backend that serializes sessions (e.g. pickled into redis) sees each
+    change.
+'''
+class SessionStore:
+    def get(self, id):
+        raise NotImplementedError
+
+    def put(self, session):
+        raise NotImplementedError
+
+    def delete(self, id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+'''
+MemorySessionStore
+    sessions in this process's memory. each one expires `ttl` seconds after
+    it was last used, and beyond `max_sessions` the least recently used
+    are evicted. entries are kept in order of use, so the expired ones are
+    always at the front and eviction never scans the live ones.
+'''
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl=3600, max_sessions=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.expired = 0
+        self.evicted = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, id):
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(id)
+            if entry is None:
+                return None
+            self._sessions[id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(id)
+            return entry[1]
+
+    def put(self, session):
+        now = self.clock()
+        with self._lock:
+            self._sessions[session.id] = (now + self.ttl, session)
+            self._sessions.move_to_end(session.id)
+            self._evict(now)
+
+    def delete(self, id):
+        with self._lock:
+            self._sessions.pop(id, None)
+
+    def _evict(self, now):
+        sessions = self._sessions
+        while sessions:
+            id, (expires, _) = next(iter(sessions.items()))
+            if expires > now:
+                break
+            del sessions[id]
+            self.expired += 1
+        while len(sessions) > self.max_sessions:
+            sessions.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'max_sessions': self.max_sessions,
+            'ttl': self.ttl,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
@@ -0,0 +1,245 @@
+import math
+import re
+import threading
+from markupsafe import escape
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import object_session
+
+from listeners import listen
+
+
+WORD = re.compile(r'\w+')
+STOPWORDS = frozenset('''
+    a an and are as at be by did do does for from how in is it of on or
+    the this to was were what when where which who whom why with
+'''.split())
+
+# the same expression in the index and in the queries, so postgres uses it
+DOCUMENT = "to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))"
+POSTGRES_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING gin ({})'.format(DOCUMENT),
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm ON questions USING gin (answer gin_trgm_ops)',
+]
+
+
+def words(text):
+    return [word for word in WORD.findall((text or '').lower()) if word not in STOPWORDS]
+
+def trigrams(text):
+    text = (text or '').lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+'''
+highlight(text, term)
+    `text` as html with the words of `term` (and words starting with them,
+    for plurals and other suffixes) and any occurrence of the whole term
+    wrapped in <mark>.
+'''
+def highlight(text, term):
+    text = text or ''
+    lowered = text.lower()
+    terms = words(term)
+    spans = [m.span() for m in WORD.finditer(text)
+             if any(m.group().lower().startswith(t) for t in terms)]
+    phrase = term.strip().lower()
+    if phrase:
+        start = lowered.find(phrase)
+        while start != -1:
+            spans.append((start, start + len(phrase)))
+            start = lowered.find(phrase, start + len(phrase))
+    html, position = [], 0
+    for start, end in merge_spans(spans):
+        html += [str(escape(text[position:start])), '<mark>',
+                 str(escape(text[start:end])), '</mark>']
+        position = end
+    html.append(str(escape(text[position:])))
+    return ''.join(html)
+
+def merge_spans(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+'''
+InvertedIndex
+    in-memory full text index over question and answer, for databases
+    without one (sqlite in development and tests). a question matches when
+    it contains every word of the term, ranked by tf-idf; questions that
+    only contain the term as a substring come after them, found through a
+    trigram index and confirmed with a substring test.
+'''
+class InvertedIndex:
+    def __init__(self, rows=()):
+        self.texts = {}
+        self.lengths = {}
+        self.postings = {}
+        self.grams = {}
+        for row in rows:
+            self.add(*row)
+
+    def add(self, id, question, answer):
+        text = '{} {}'.format(question or '', answer or '').lower()
+        tokens = words(text)
+        self.texts[id] = text
+        self.lengths[id] = len(tokens) or 1
+        for token in tokens:
+            postings = self.postings.setdefault(token, {})
+            postings[id] = postings.get(id, 0) + 1
+        for gram in trigrams(text):
+            self.grams.setdefault(gram, set()).add(id)
+
+    def remove(self, id):
+        text = self.texts.pop(id, None)
+        if text is None:
+            return
+        del self.lengths[id]
+        for token in set(words(text)):
+            self.postings[token].pop(id, None)
+        for gram in trigrams(text):
+            self.grams[gram].discard(id)
+
+    def search(self, term):
+        '''ids of matching questions, best first.'''
+        tokens = set(words(term))
+        ranked = []
+        if tokens:
+            postings = sorted((self.postings.get(token, {}) for token in tokens), key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+            count = len(self.texts)
+            scores = {id: sum(p[id] / self.lengths[id] * math.log(1 + count / len(p))
+                              for p in postings) for id in ids}
+            ranked = sorted(ids, key=lambda id: (-scores[id], id))
+        return ranked + sorted(set(self.substring(term)) - set(ranked))
+
+    def substring(self, term):
+        term = term.strip().lower()
+        grams = trigrams(term)
+        if grams:
+            sets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+            candidates = sets[0].intersection(*sets[1:])
+        else:
+            candidates = self.texts
+        return [id for id in candidates if term in self.texts[id]]
+
+
+'''
+QuestionSearch
+    full text search on the question and answer of `model`, with a
+    substring fallback, ranked and paginated.
+
+    on postgres it runs on a tsvector GIN index and pg_trgm GIN indexes on
+    question and answer, created by create_indexes(). elsewhere it uses an
+    InvertedIndex built on first use and kept up to date as questions are
+    inserted, updated and deleted: each flush records the changes in the
+    session, applied to the index when it commits and dropped if it rolls
+    back.
+'''
+class QuestionSearch:
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+        self._index = None
+        self._lock = threading.Lock()
+        for name, change in (('after_insert', QuestionSearch._add), ('after_update', QuestionSearch._add),
+                             ('after_delete', QuestionSearch._remove)):
+            listen(model, name, self, change)
+        listen(db.session, 'after_commit', self, QuestionSearch._after_commit)
+        listen(db.session, 'after_rollback', self, QuestionSearch._after_rollback)
+
+    @property
+    def use_postgres(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def create_indexes(self):
+        if not self.use_postgres:
+            return
+        for statement in POSTGRES_INDEXES:
+            try:
+                with self.db.engine.begin() as connection:
+                    connection.execute(statement)
+            except SQLAlchemyError:
+                # pg_trgm may not be installable here; search still works
+                # without the trigram indexes, only slower for substrings
+                pass
+
+    def search(self, term, page=1, per_page=10):
+        '''(total, [(question, highlighted question, highlighted answer)]) for one page.'''
+        term = term or ''
+        offset = (page - 1) * per_page
+        if self.use_postgres:
+            total, questions = self._search_postgres(term, offset, per_page)
+        else:
+            ids = self.index().search(term) if term.strip() else None
+            total, questions = self._load(ids, offset, per_page)
+        return total, [(q, highlight(q.question, term), highlight(q.answer, term)) for q in questions]
+
+    def _search_postgres(self, term, offset, limit):
+        model = self.model
+        document = literal_column(DOCUMENT)
+        tsquery = func.plainto_tsquery(literal_column("'english'"), term)
+        pattern = '%' + escape_like(term.strip()) + '%'
+        query = self.db.session.query(model, func.count().over()).filter(or_(
+            document.op('@@')(tsquery),
+            model.question.ilike(pattern, escape='\\'),
+            model.answer.ilike(pattern, escape='\\')
+        )).order_by(func.ts_rank(document, tsquery).desc(), model.id)
+        rows = query.offset(offset).limit(limit).all()
+        if rows:
+            return rows[0][1], [question for question, _ in rows]
+        return query.with_entities(func.count()).order_by(None).scalar(), []
+
+    def _load(self, ids, offset, limit):
+        model = self.model
+        if ids is None:
+            query = model.query.order_by(model.id)
+            return query.count(), query.offset(offset).limit(limit).all()
+        page = ids[offset:offset + limit]
+        questions = {q.id: q for q in model.query.filter(model.id.in_(page))} if page else {}
+        return len(ids), [questions[id] for id in page if id in questions]
+
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                model = self.model
+                self._index = InvertedIndex(self.db.session.query(
+                    model.id, model.question, model.answer))
+            return self._index
+
+    # keyed by the search, as several apps (in tests) can share a session
+    def _record(self, target, document):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault((self, 'pending'), {})[target.id] = document
+
+    def _add(self, mapper, connection, target):
+        self._record(target, (target.question, target.answer))
+
+    def _remove(self, mapper, connection, target):
+        self._record(target, None)
+
+    def _after_commit(self, session):
+        pending = session.info.pop((self, 'pending'), None)
+        if not pending:
+            return
+        with self._lock:
+            if self._index is None:
+                return
+            for id, document in pending.items():
+                self._index.remove(id)
+                if document is not None:
+                    self._index.add(id, *document)
+
+    def _after_rollback(self, session):
+        session.info.pop((self, 'pending'), None)
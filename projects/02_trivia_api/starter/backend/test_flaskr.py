@@ -4,7 +4,7 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,11 +12,11 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        # create_app loads the caches from the database, so it must start on the test one
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = self.app.test_client
 
         # binds the app to the current context
         with self.app.app_context():
@@ -34,6 +34,147 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def test_metrics(self):
+        client = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                             'INTERNAL_ENDPOINTS': True}).test_client()
+        client.get('/categories')
+        res = client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count', res.data.decode())
+
+    def test_404_metrics_when_internal_endpoints_are_off(self):
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_app_adds_no_listeners(self):
+        listeners = len(Question.__mapper__.dispatch.after_insert)
+        create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+
+        self.assertEqual(len(Question.__mapper__.dispatch.after_insert), listeners)
+
+    def test_404_category_cache_stats_when_internal_endpoints_are_off(self):
+        res = self.client().get('/internal/category-cache')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_category_cache_stats(self):
+        client = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                             'INTERNAL_ENDPOINTS': True}).test_client()
+        res = client.get('/internal/category-cache')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['categories'], 6)
+
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['categories']), 6)
+        self.assertEqual(data['categories']['1'], 'Science')
+
+    def test_get_questions_paginated(self):
+        res = self.client().get('/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 9)
+        self.assertEqual(data['total_questions'], 19)
+        self.assertEqual(len(data['categories']), 6)
+
+    def test_category_question_count_follows_inserts_and_deletes(self):
+        with self.app.app_context():
+            question = Question('Which planet is largest?', 'Jupiter', 1, 1)
+            question.insert()
+            res = self.client().get('/categories/1/questions')
+            self.assertEqual(json.loads(res.data)['total_questions'], 4)
+
+            Question.query.get(question.id).delete()
+            res = self.client().get('/categories/1/questions')
+            self.assertEqual(json.loads(res.data)['total_questions'], 3)
+
+    def test_get_category_questions(self):
+        res = self.client().get('/categories/4/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['current_category'], 'History')
+        self.assertEqual(data['total_questions'], 4)
+        self.assertEqual([q['id'] for q in data['questions']], [5, 9, 12, 23])
+        self.assertTrue(all(q['category'] == 4 for q in data['questions']))
+
+    def test_404_get_questions_of_unknown_category(self):
+        res = self.client().get('/categories/1000/questions')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_search_questions_ranks_word_matches_before_substrings(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual([q['id'] for q in data['questions']], [6, 5])
+        self.assertIn('<mark>title</mark>', data['questions'][0]['highlight']['question'])
+
+    def test_search_questions_without_results(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'xyzzy'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 0)
+        self.assertEqual(data['questions'], [])
+
+    def test_play_quiz_skips_previous_questions(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20, 21],
+            'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 22)
+
+    def test_play_quiz_ends_when_no_question_is_left(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20, 21, 22],
+            'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(data['question'])
+
+    def test_play_quiz_session_asks_each_question_once(self):
+        res = self.client().post('/quizzes', json={
+            'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+        asked = [data['question']['id']]
+        while data['question']:
+            res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+            data = json.loads(res.data)
+            if data['question']:
+                asked.append(data['question']['id'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(asked), [20, 21, 22])
+
+    def test_404_play_quiz_with_unknown_session(self):
+        res = self.client().post('/quizzes', json={'quiz_session': 'expired'})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_400_play_quiz_with_non_string_session(self):
+        for session_id in (['x'], {'id': 'x'}, 1):
+            res = self.client().post('/quizzes', json={'quiz_session': session_id})
+
+            self.assertEqual(res.status_code, 400)
+
+    def test_400_play_quiz_with_malformed_previous_questions(self):
+        res = self.client().post('/quizzes', json={'previous_questions': 'none'})
+
+        self.assertEqual(res.status_code, 400)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -1,15 +1,41 @@
 import os
-from flask import Flask, request, abort, jsonify
+import json
+import base64
+from flask import Flask, request, abort, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
 from models import *
 from auth import *
+from response_cache import ResponseCache, LRUBackend
+from instrumentation import Instrumentation
 
 ROWS_PER_PAGE = 10
+MAX_ROWS_PER_PAGE = 100
+MAX_BULK_ITEMS = 1000
+EXPORT_BATCH_SIZE = 1000
+
+def encode_cursor(last_id):
+  return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(cursor):
+  try:
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+  except (ValueError, UnicodeError):
+    abort(400)
 
 def create_app(test_config=None):
   app = Flask(__name__)
   setup_db(app)
+  # /metrics and /internal/* carry no auth; they are only served when the
+  # deployment opts in, e.g. behind a private network
+  internal_endpoints = os.environ.get('ENABLE_INTERNAL_ENDPOINTS', 'false').lower() == 'true'
+  Instrumentation(app, db, path='/metrics' if internal_endpoints else None)
+
+  response_cache = ResponseCache(
+    LRUBackend(max_size=int(os.environ.get('RESPONSE_CACHE_SIZE', 512))))
+  app.extensions['response_cache'] = response_cache
+  on_tables_changed(app, response_cache.invalidate)
 
   cors = CORS(app)
   @app.after_request
@@ -21,41 +47,274 @@ def create_app(test_config=None):
     return response
   
 
-  def paginate(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start =  (page - 1) * ROWS_PER_PAGE
-    end = start + ROWS_PER_PAGE
-
-    objects = [objects.format() for objects in selection]
-    objects_formatted = objects[start:end]
-    return objects_formatted
+  '''
+  paginate(request, model)
+    fetches one page of `model` rows in the database, ordered by id.
+    ?cursor=<next_cursor> continues after the last row of the previous page
+    (keyset pagination), otherwise ?page=N uses LIMIT/OFFSET.
+    ?per_page=N sets the page size (capped at MAX_ROWS_PER_PAGE) and
+    ?count=false skips the total count query.
+    `include` names a relationship that is loaded for the whole page in one
+    extra selectin query and nested into each formatted row.
+  '''
+  def paginate(request, model, include=None):
+    per_page = request.args.get('per_page', ROWS_PER_PAGE, type=int)
+    if per_page < 1:
+      abort(400)
+    per_page = min(per_page, MAX_ROWS_PER_PAGE)
+
+    query = model.query.order_by(model.id)
+    if include:
+      query = query.options(selectinload(getattr(model, include)))
+    cursor = request.args.get('cursor')
+    if cursor:
+      query = query.filter(model.id > decode_cursor(cursor))
+    else:
+      page = request.args.get('page', 1, type=int)
+      query = query.offset(max(page - 1, 0) * per_page)
+
+    rows = query.limit(per_page).all()
+    objects_formatted = [format_row(row, include) for row in rows]
+
+    next_cursor = None
+    if len(rows) == per_page:
+      next_cursor = encode_cursor(rows[-1].id)
+
+    total = None
+    if request.args.get('count', 'true').lower() != 'false':
+      total = model.query.count()
+
+    return objects_formatted, total, next_cursor
+
+  def format_row(row, include=None):
+    formatted = row.format()
+    if include:
+      formatted[include] = [related.format() for related in getattr(row, include)]
+    return formatted
+
+  '''
+  get_include(request, payload, relationship, permission)
+    reads ?include=<relationship>; the caller also needs `permission` to
+    see the related rows.
+  '''
+  def get_include(request, payload, relationship, permission):
+    include = request.args.get('include')
+    if not include:
+      return None
+    if include != relationship:
+      abort(400)
+    check_permissions(permission, payload)
+    return include
   
+  '''
+  bulk helpers
+    every item of a bulk request is validated before anything is written;
+    a single invalid item rejects the whole batch with a 422 listing the
+    errors by index.
+  '''
+  def bulk_items(request):
+    items = request.get_json()
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ITEMS:
+      abort(422)
+    return items
+
+  def bulk_unprocessable(errors):
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'unprocessable',
+      'errors': errors
+    }), 422
+
+  def missing_ids(model, ids):
+    found = db.session.query(model.id).filter(model.id.in_(ids)).all()
+    return set(ids) - {row.id for row in found}
+
+  def is_id(value):
+    # bool is a subclass of int, but True is not an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+  def validate_bulk_create(items, fields):
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+      if not isinstance(item, dict):
+        errors.append({'index': index, 'message': 'item must be an object'})
+        continue
+      missing = [field for field in fields if field not in item]
+      if missing:
+        errors.append({'index': index, 'message': 'missing ' + ', '.join(missing)})
+        continue
+      rows.append({field: item[field] for field in fields})
+    return rows, errors
+
+  def validate_bulk_update(model, items, fields):
+    rows = []
+    errors = []
+    seen = set()
+    for index, item in enumerate(items):
+      if not isinstance(item, dict) or not is_id(item.get('id')):
+        errors.append({'index': index, 'message': 'item must have an integer id'})
+        continue
+      if item['id'] in seen:
+        errors.append({'index': index, 'message': 'duplicate id'})
+        continue
+      seen.add(item['id'])
+      row = {field: item[field] for field in fields if item.get(field)}
+      row['id'] = item['id']
+      rows.append(row)
+
+    missing = missing_ids(model, seen) if seen else set()
+    for index, item in enumerate(items):
+      if isinstance(item, dict) and item.get('id') in missing:
+        errors.append({'index': index, 'message': 'resource not found'})
+    return rows, errors
+
+  def validate_bulk_delete(model, items):
+    errors = []
+    for index, item in enumerate(items):
+      if not is_id(item):
+        errors.append({'index': index, 'message': 'item must be an integer id'})
+    if errors:
+      return [], errors
+
+    ids = list(dict.fromkeys(items))
+    missing = missing_ids(model, ids)
+    for index, item in enumerate(items):
+      if item in missing:
+        errors.append({'index': index, 'message': 'resource not found'})
+    return ids, errors
+
   @app.route('/actors')
   @requires_auth('get:actors')
+  @response_cache.cached('actors', 'movies')
   def get_actors(payload):
-    actors = Actor.query.all()
-    actors_paginate = paginate(request, actors)
+    include = get_include(request, payload, 'movies', 'get:movies')
+    actors_paginate, total, next_cursor = paginate(request, Actor, include)
 
     if not actors_paginate:
       abort(404)
 
     return jsonify({
       'success': True,
-      'actors': actors_paginate
+      'actors': actors_paginate,
+      'total_actors': total,
+      'next_cursor': next_cursor
     }), 200
 
   @app.route('/movies')
   @requires_auth('get:movies')
+  @response_cache.cached('actors', 'movies')
   def get_movies(payload):
-    movies = Movie.query.all()
-    movies_paginate = paginate(request, movies)
+    include = get_include(request, payload, 'actors', 'get:actors')
+    movies_paginate, total, next_cursor = paginate(request, Movie, include)
 
     if not movies_paginate:
       abort(404)
 
     return jsonify({
       'success': True,
-      'movies': movies_paginate
+      'movies': movies_paginate,
+      'total_movies': total,
+      'next_cursor': next_cursor
+    }), 200
+
+  '''
+  export(model)
+    streams every row of `model` as newline-delimited JSON. rows are read
+    through a server-side cursor in batches of EXPORT_BATCH_SIZE, so memory
+    stays flat however large the table is.
+  '''
+  def export(model):
+    def generate():
+      query = model.query.order_by(model.id).yield_per(EXPORT_BATCH_SIZE)
+      for row in query:
+        yield json.dumps(row.format()) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+  @app.route('/actors/export')
+  @requires_auth('get:actors')
+  def export_actors(payload):
+    return export(Actor)
+
+  @app.route('/movies/export')
+  @requires_auth('get:movies')
+  def export_movies(payload):
+    return export(Movie)
+
+  @app.route('/movies/<int:movie_id>/actors')
+  @requires_auth('get:actors')
+  @response_cache.cached('actors', 'movies')
+  def get_movie_actors(payload, movie_id):
+    movie = Movie.query.options(selectinload(Movie.actors)).get(movie_id)
+    if not movie:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'movie': movie.id,
+      'actors': [actor.format() for actor in movie.actors]
+    }), 200
+
+  @app.route('/actors/<int:actor_id>/movies')
+  @requires_auth('get:movies')
+  @response_cache.cached('actors', 'movies')
+  def get_actor_movies(payload, actor_id):
+    actor = Actor.query.options(selectinload(Actor.movies)).get(actor_id)
+    if not actor:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'actor': actor.id,
+      'movies': [movie.format() for movie in actor.movies]
+    }), 200
+
+  @app.route('/movies/<int:movie_id>/actors', methods=['POST'])
+  @requires_auth('patch:movies')
+  def cast_actors(payload, movie_id):
+    movie = Movie.query.get(movie_id)
+    if not movie:
+      abort(404)
+
+    data = request.get_json()
+    if not data or not isinstance(data.get('actors'), list):
+      abort(422)
+    if not all(is_id(actor_id) for actor_id in data['actors']):
+      abort(422)
+
+    actors = Actor.query.filter(Actor.id.in_(data['actors'])).all()
+    if len(actors) != len(set(data['actors'])):
+      abort(422)
+
+    for actor in actors:
+      if actor not in movie.actors:
+        movie.actors.append(actor)
+    movie.update()
+
+    return jsonify({
+      'success': True,
+      'movie': movie.id,
+      'actors': [actor.format() for actor in movie.actors]
+    }), 200
+
+  @app.route('/movies/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
+  @requires_auth('patch:movies')
+  def uncast_actor(payload, movie_id, actor_id):
+    movie = Movie.query.get(movie_id)
+    actor = Actor.query.get(actor_id)
+    if not movie or not actor or actor not in movie.actors:
+      abort(404)
+
+    movie.actors.remove(actor)
+    movie.update()
+
+    return jsonify({
+      'success': True,
+      'movie': movie.id,
+      'deleted': actor.id
     }), 200
 
   @app.route('/actors', methods=['POST'])
@@ -189,6 +448,102 @@ def create_app(test_config=None):
       'deleted': movie.id
     }), 200
 
+  @app.route('/actors/bulk', methods=['POST'])
+  @requires_auth('post:actors')
+  def add_actors_bulk(payload):
+    rows, errors = validate_bulk_create(bulk_items(request),
+                                        ['name', 'age', 'gender'])
+    if errors:
+      return bulk_unprocessable(errors)
+
+    ids = bulk_insert(Actor, rows)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': id, 'status': 'created'} for id in ids]
+    }), 200
+
+  @app.route('/movies/bulk', methods=['POST'])
+  @requires_auth('post:movies')
+  def add_movies_bulk(payload):
+    rows, errors = validate_bulk_create(bulk_items(request),
+                                        ['title', 'release'])
+    if errors:
+      return bulk_unprocessable(errors)
+
+    ids = bulk_insert(Movie, rows)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': id, 'status': 'created'} for id in ids]
+    }), 200
+
+  @app.route('/actors/bulk', methods=['PATCH'])
+  @requires_auth('patch:actors')
+  def update_actors_bulk(payload):
+    rows, errors = validate_bulk_update(Actor, bulk_items(request),
+                                        ['name', 'age', 'gender'])
+    if errors:
+      return bulk_unprocessable(errors)
+
+    bulk_update(Actor, rows)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': row['id'], 'status': 'updated'} for row in rows]
+    }), 200
+
+  @app.route('/movies/bulk', methods=['PATCH'])
+  @requires_auth('patch:movies')
+  def update_movies_bulk(payload):
+    rows, errors = validate_bulk_update(Movie, bulk_items(request),
+                                        ['title', 'release'])
+    if errors:
+      return bulk_unprocessable(errors)
+
+    bulk_update(Movie, rows)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': row['id'], 'status': 'updated'} for row in rows]
+    }), 200
+
+  @app.route('/actors/bulk', methods=['DELETE'])
+  @requires_auth('delete:actors')
+  def delete_actors_bulk(payload):
+    ids, errors = validate_bulk_delete(Actor, bulk_items(request))
+    if errors:
+      return bulk_unprocessable(errors)
+
+    bulk_delete(Actor, ids)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': id, 'status': 'deleted'} for id in ids]
+    }), 200
+
+  @app.route('/movies/bulk', methods=['DELETE'])
+  @requires_auth('delete:movies')
+  def delete_movies_bulk(payload):
+    ids, errors = validate_bulk_delete(Movie, bulk_items(request))
+    if errors:
+      return bulk_unprocessable(errors)
+
+    bulk_delete(Movie, ids)
+
+    return jsonify({
+      'success': True,
+      'results': [{'id': id, 'status': 'deleted'} for id in ids]
+    }), 200
+
+  if internal_endpoints:
+    @app.route('/internal/db-pool')
+    def db_pool_stats():
+      return jsonify({
+        'success': True,
+        'db_pool': app.extensions['db_pool_metrics'].stats()
+      }), 200
+
   @app.errorhandler(400)
   def bad_request(error):
     return jsonify({
@@ -1,14 +1,25 @@
-import json
+import os
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from jwks import JWKSCache
+from token_cache import TokenCache
+from instrumentation import timed
 
 
 AUTH0_DOMAIN = 'salgarishi.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'Agency'
 
+jwks_cache = JWKSCache(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    ttl=int(os.environ.get('JWKS_CACHE_TTL', 3600)),
+    refresh_ahead=int(os.environ.get('JWKS_REFRESH_AHEAD', 300)),
+    min_refetch_interval=int(os.environ.get('JWKS_MIN_REFETCH_INTERVAL', 30))
+)
+
+token_cache = TokenCache(max_size=int(os.environ.get('TOKEN_CACHE_SIZE', 1024)))
+
 class authError(Exception):
     def __init__(self, error, status_code):
         self.error = error
@@ -62,9 +73,6 @@ def check_permissions(permission, payload):
     return True
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-
     unverified_header = jwt.get_unverified_header(token)
 
     rsa_key = {}
@@ -74,15 +82,15 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    key = jwks_cache.get_key(unverified_header['kid'])
+    if key:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -121,15 +129,19 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise authError({
-                    'code': 'unauthorized',
-                    'description': 'Permissions not found' 
-                }, 401)
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    try:
+                        payload = verify_decode_jwt(token)
+                    except:
+                        raise authError({
+                            'code': 'unauthorized',
+                            'description': 'Permissions not found' 
+                        }, 401)
+                    token_cache.put(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
\ No newline at end of file
@@ -0,0 +1,363 @@
+'''
+Benchmark and load test for the Agency API.
+
+Seeds a database with a configurable number of actors and movies, serves
+the public half of a locally generated RSA key as a fake JWKS, mints tokens
+signed with it and measures throughput and p50/p90/p99 latency for each
+endpoint, first through the Flask test client and then over HTTP against a
+real (threaded werkzeug) WSGI server. Results are written as JSON so runs
+of different commits can be compared:
+
+    python benchmark.py --actors 100000 --movies 100000 --output before.json
+    python benchmark.py --actors 100000 --movies 100000 --compare before.json
+
+The database defaults to a throwaway sqlite file; pass --database-url to
+run against Postgres. Seeding refuses to touch a --database-url whose
+tables already hold rows unless --reset is given, which drops them.
+'''
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+PERMISSIONS = [
+    'get:actors', 'get:movies', 'post:actors', 'post:movies',
+    'patch:actors', 'patch:movies', 'delete:actors', 'delete:movies'
+]
+
+'''
+ENDPOINTS
+    (name, method, path, body). `{page}` and `{id}` are filled in per
+    request so that consecutive requests do not all hit the same cached
+    response or row.
+'''
+ENDPOINTS = [
+    ('list_actors', 'GET', '/actors?page={page}', None),
+    ('list_actors_no_count', 'GET', '/actors?page={page}&count=false', None),
+    ('list_movies_include_actors', 'GET', '/movies?page={page}&include=actors', None),
+    ('movie_actors', 'GET', '/movies/{id}/actors', None),
+    ('create_actor', 'POST', '/actors',
+     {'name': 'Benchmark Actor', 'age': 30, 'gender': 'female'}),
+    ('update_movie', 'PATCH', '/movies/{id}', {'release': '2021'}),
+]
+
+
+def b64url_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+'''
+TestKey
+    a fresh RSA key pair; the public half as a JWKS document, the private
+    half used to mint tokens the API accepts
+'''
+class TestKey:
+    def __init__(self, kid='benchmark'):
+        import rsa
+        self.kid = kid
+        public_key, private_key = rsa.newkeys(2048)
+        self.private_pem = private_key.save_pkcs1().decode()
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': b64url_uint(public_key.n),
+            'e': b64url_uint(public_key.e)
+        }]}
+
+    def mint(self, permissions, domain, audience, lifetime=3600):
+        from jose import jwt
+        now = int(time.time())
+        claims = {
+            'iss': 'https://' + domain + '/',
+            'sub': 'benchmark|{}'.format(random.randrange(1 << 30)),
+            'aud': audience,
+            'iat': now,
+            'exp': now + lifetime,
+            'permissions': permissions
+        }
+        return jwt.encode(claims, self.private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+
+def serve_jwks(jwks):
+    body = json.dumps(jwks).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def holds_rows(db):
+    '''whether any of the models' tables already exists with rows in it.'''
+    from sqlalchemy import inspect
+    existing = set(inspect(db.engine).get_table_names())
+    return any(db.session.execute(table.select().limit(1)).first() is not None
+               for table in db.metadata.sorted_tables if table.name in existing)
+
+
+def seed(db, Actor, Movie, casting, actors, movies, cast_per_movie, reset=False,
+         batch_size=10000):
+    if reset:
+        db.drop_all()
+    db.create_all()
+
+    def insert(table, count, row):
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            db.session.execute(table.insert(), [row(i) for i in range(start, stop)])
+            db.session.commit()
+
+    insert(Actor.__table__, actors, lambda i: {
+        'name': 'Actor {}'.format(i), 'age': str(20 + i % 60),
+        'gender': 'female' if i % 2 else 'male'})
+    insert(Movie.__table__, movies, lambda i: {
+        'title': 'Movie {}'.format(i), 'release': str(1950 + i % 70)})
+
+    if actors and cast_per_movie:
+        def cast(i):
+            movie_id, slot = divmod(i, cast_per_movie)
+            return {'movie_id': movie_id + 1,
+                    'actor_id': (movie_id * cast_per_movie + slot) % actors + 1}
+        insert(casting, movies * min(cast_per_movie, actors), cast)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': round(1000 * percentile(latencies, 0.50), 3) if latencies else None,
+        'p90_ms': round(1000 * percentile(latencies, 0.90), 3) if latencies else None,
+        'p99_ms': round(1000 * percentile(latencies, 0.99), 3) if latencies else None
+    }
+
+
+def fill(path, pages, ids):
+    return path.format(page=random.randint(1, pages), id=random.randint(1, ids))
+
+
+def run_test_client(app, token, requests, pages, ids):
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token}
+    results = {}
+    for name, method, path, body in ENDPOINTS:
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            start = time.perf_counter()
+            res = client.open(fill(path, pages, ids), method=method,
+                              json=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if res.status_code >= 400:
+                errors += 1
+        results[name] = summarize(latencies, errors, time.perf_counter() - started)
+    return results
+
+
+def run_wsgi(app, token, requests, concurrency, pages, ids):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    def call(method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = Request(base + path, data=data, method=method, headers={
+            'Authorization': 'Bearer ' + token,
+            'Content-Type': 'application/json'
+        })
+        start = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+                ok = True
+        except HTTPError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, method, path, body in ENDPOINTS:
+                started = time.perf_counter()
+                outcomes = list(pool.map(
+                    lambda _: call(method, fill(path, pages, ids), body),
+                    range(requests)))
+                elapsed = time.perf_counter() - started
+                results[name] = summarize(
+                    [latency for latency, _ in outcomes],
+                    sum(1 for _, ok in outcomes if not ok), elapsed)
+    finally:
+        server.shutdown()
+    return results
+
+
+def compare(current, previous):
+    for runner, endpoints in current['results'].items():
+        for name, stats in endpoints.items():
+            before = previous.get('results', {}).get(runner, {}).get(name)
+            if not before:
+                continue
+            parts = []
+            for key in ('throughput', 'p50_ms', 'p99_ms'):
+                if stats[key] and before[key]:
+                    change = 100.0 * (stats[key] - before[key]) / before[key]
+                    parts.append('{} {} -> {} ({:+.1f}%)'.format(
+                        key, before[key], stats[key], change))
+            print('{:<10} {:<28} {}'.format(runner, name, '  '.join(parts)))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--actors', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=10000)
+    parser.add_argument('--cast-per-movie', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint and runner')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='client threads for the WSGI server run')
+    parser.add_argument('--database-url',
+                        help='defaults to a temporary sqlite database')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='reuse the rows already in --database-url')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop the tables of --database-url before seeding it')
+    parser.add_argument('--disable-caches', action='store_true',
+                        help='turn off the token and response caches')
+    parser.add_argument('--runner', choices=['test_client', 'wsgi', 'both'],
+                        default='both')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args(argv)
+
+    # models and auth read their configuration from the environment on import
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    if args.disable_caches:
+        os.environ['TOKEN_CACHE_SIZE'] = '0'
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+
+    import auth
+    from app import create_app
+    from models import db, Actor, Movie, casting
+
+    key = TestKey()
+    jwks_server = serve_jwks(key.jwks)
+    auth.jwks_cache.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+        jwks_server.server_port)
+    auth.jwks_cache.clear()
+    token = key.mint(PERMISSIONS, auth.AUTH0_DOMAIN, auth.API_AUDIENCE)
+
+    app = create_app()
+    with app.app_context():
+        if not args.no_seed:
+            # only the temporary sqlite database is ours to wipe
+            reset = args.reset or not args.database_url
+            if not reset and holds_rows(db):
+                sys.exit('--database-url already holds rows: pass --reset to drop '
+                         'its tables and reseed, or --no-seed to benchmark them')
+            started = time.perf_counter()
+            seed(db, Actor, Movie, casting, args.actors, args.movies,
+                 args.cast_per_movie, reset=reset)
+            print('seeded {} actors and {} movies in {:.1f}s'.format(
+                args.actors, args.movies, time.perf_counter() - started))
+        actors = Actor.query.count()
+        movies = Movie.query.count()
+
+    from app import ROWS_PER_PAGE
+    pages = max(1, min(actors, movies) // ROWS_PER_PAGE)
+    ids = max(1, movies)
+
+    results = {}
+    if args.runner in ('test_client', 'both'):
+        results['test_client'] = run_test_client(app, token, args.requests, pages, ids)
+    if args.runner in ('wsgi', 'both'):
+        results['wsgi'] = run_wsgi(app, token, args.requests, args.concurrency,
+                                   pages, ids)
+    jwks_server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'config': {
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+            'actors': actors,
+            'movies': movies,
+            'cast_per_movie': args.cast_per_movie,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'caches': not args.disable_caches
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for runner, endpoints in results.items():
+        for name, stats in endpoints.items():
+            print('{:<12} {:<28} {:>9} req/s  p50 {:>8} ms  p99 {:>8} ms  errors {}'.format(
+                runner, name, stats['throughput'], stats['p50_ms'], stats['p99_ms'],
+                stats['errors']))
+    print('results written to ' + args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
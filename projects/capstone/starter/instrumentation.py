@@ -0,0 +1,169 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+'''
+timed(phase)
+    adds the time spent in the block to `phase` (e.g. 'auth', 'db',
+    'serialize') for the current request. outside a request it does nothing.
+'''
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+def record_phase(phase, seconds):
+    if not has_request_context():
+        return
+    phases = g.setdefault('_instrumentation_phases', {})
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+'''
+Histogram
+    cumulative-bucket histogram in the Prometheus sense, one series per
+    label tuple
+'''
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} histogram'.format(self.name)
+        ]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = format_labels(self.labels, label_values)
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        self.name, labels, bound, count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                    self.name, labels, series['count']))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, labels, series['sum']))
+                lines.append('{}_count{{{}}} {}'.format(self.name, labels, series['count']))
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join('{}="{}"'.format(name, escape_label(value))
+                    for name, value in zip(names, values))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+'''
+Instrumentation
+    per-route request latency, plus the share of each request spent in
+    auth, database and json serialization, exposed in the Prometheus text
+    format at `path` (or not served at all if `path` is None, when the app
+    exposes expose() itself). database time comes from the engine's
+    before/after_cursor_execute events when `db` is given; auth time is
+    whatever the views record with timed('auth').
+'''
+class Instrumentation:
+    def __init__(self, app=None, db=None, path='/metrics'):
+        self.path = path
+        self.requests = Histogram(
+            'http_request_duration_seconds', 'Request latency by route.',
+            ('method', 'route', 'status'))
+        self.phases = Histogram(
+            'http_request_phase_duration_seconds',
+            'Time spent in each phase of a request, by route.',
+            ('route', 'phase'))
+        self.queries = Histogram(
+            'http_request_db_queries', 'Database queries per request, by route.',
+            ('route',), buckets=(0, 1, 2, 5, 10, 25, 50, 100))
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        app.extensions['instrumentation'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.json_encoder = timed_json_encoder(app.json_encoder)
+        if self.path:
+            app.add_url_rule(self.path, 'metrics', self.metrics_view)
+        if db is not None:
+            with app.app_context():
+                self.attach_engine(db.engine)
+
+    def attach_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('_instrumentation_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        start = conn.info['_instrumentation_start'].pop()
+        record_phase('db', time.perf_counter() - start)
+        if has_request_context():
+            g._instrumentation_queries = g.get('_instrumentation_queries', 0) + 1
+
+    def _handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('_instrumentation_start'):
+            connection.info['_instrumentation_start'].pop()
+
+    def _before_request(self):
+        g._instrumentation_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.get('_instrumentation_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+        self.requests.observe((request.method, route, response.status_code), elapsed)
+        for phase, seconds in g.get('_instrumentation_phases', {}).items():
+            self.phases.observe((route, phase), seconds)
+        self.queries.observe((route,), g.get('_instrumentation_queries', 0))
+        return response
+
+    def expose(self):
+        lines = self.requests.expose() + self.phases.expose() + self.queries.expose()
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.expose(), mimetype='text/plain; version=0.0.4')
+
+
+def timed_json_encoder(base):
+    class TimedJSONEncoder(base):
+        def encode(self, o):
+            with timed('serialize'):
+                return super().encode(o)
+    return TimedJSONEncoder
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+JWKSCache
+    process-wide cache of the signing keys published at a JWKS url, keyed by kid.
+    - keys expire after `ttl` seconds and are refreshed in a background thread
+      once they are within `refresh_ahead` seconds of expiring
+    - an unknown kid forces one refetch, at most once every `min_refetch_interval`
+    - when a refetch fails the last good copy keeps being served
+    - only one fetch runs at a time, and every refetch (background, expired,
+      unknown kid) waits `min_refetch_interval` after the last attempt
+'''
+class JWKSCache:
+    def __init__(self, url, ttl=3600, refresh_ahead=300,
+                 min_refetch_interval=30, timeout=5, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.clock = clock
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def fetch(self):
+        jsonurl = urlopen(self.url, timeout=self.timeout)
+        jwks = json.loads(jsonurl.read())
+        return {key['kid']: key for key in jwks['keys'] if 'kid' in key}
+
+    def refresh(self):
+        '''
+        fetch the key set and replace the cached copy.
+        on failure the cached copy is left untouched and False is returned.
+        '''
+        self._last_attempt = self.clock()
+        try:
+            keys = self.fetch()
+        except Exception:
+            return False
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = self.clock()
+        return True
+
+    def _refresh_if_due(self, blocking=True):
+        '''
+        refresh unless another refresh is running or the last attempt was
+        less than `min_refetch_interval` ago. callers that wait for a running
+        refresh then find the interval not yet over and use its result.
+        '''
+        if not self._refresh_lock.acquire(blocking):
+            return False
+        try:
+            if not self._may_refetch():
+                return False
+            return self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_in_background(self):
+        if not self._may_refetch():
+            return
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_if_due, kwargs={'blocking': False}, daemon=True)
+            self._refresh_thread.start()
+
+    def _age(self):
+        if self._fetched_at is None:
+            return None
+        return self.clock() - self._fetched_at
+
+    def _may_refetch(self):
+        return (self._last_attempt is None or
+                self.clock() - self._last_attempt >= self.min_refetch_interval)
+
+    def get_key(self, kid):
+        '''
+        return the jwk for `kid`, or None when the key set does not contain it.
+        raises when nothing has ever been fetched and the url is unreachable.
+        '''
+        age = self._age()
+        if age is None:
+            self._refresh_if_due()
+            if self._fetched_at is None:
+                raise LookupError('Unable to fetch JWKS from ' + self.url)
+        elif age >= self.ttl:
+            # expired: try to refetch now, serve the stale copy if that fails
+            self._refresh_if_due()
+        elif age >= self.ttl - self.refresh_ahead:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._refresh_if_due():
+            key = self._keys.get(kid)
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
@@ -1,7 +1,10 @@
 import os
+from itertools import chain
+from sqlalchemy import event
 from flask_sqlalchemy import SQLAlchemy
 from flask_moment import Moment
 from flask_migrate import Migrate
+from pool_metrics import PoolMetrics, InstrumentedQueuePool
 
 
 database_path = os.environ.get('DATABASE_URL')
@@ -13,13 +16,123 @@ db = SQLAlchemy()
 moment = Moment()
 migrate = Migrate()
 
+'''
+engine_options(database_path)
+    connection pool settings, read from the environment:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a
+    connection), DB_POOL_RECYCLE (seconds before a connection is replaced)
+    and DB_POOL_PRE_PING (test connections on checkout).
+    sqlite keeps SQLAlchemy's default pool, which takes no sizing options.
+'''
+def engine_options(database_path):
+    options = {
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+    if not database_path.startswith('sqlite'):
+        options.update({
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30))
+        })
+    return options
+
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     moment.app = app
     db.init_app(app)
     migrate.init_app(app, db)
+    with app.app_context():
+        app.extensions['db_pool_metrics'] = PoolMetrics(
+            slow_wait=float(os.environ.get('DB_POOL_SLOW_WAIT', 1.0))
+        ).attach(db.engine)
+
+'''
+change tracking
+    the names of the tables written in a transaction are collected on the
+    session and, once the transaction commits, handed to every function
+    registered for the session's app with on_tables_changed(app, listener).
+    listeners are kept on the app, so they go away with it. they only see
+    commits made by this process: other workers, and writes made outside
+    the ORM session, are not reported.
+'''
+def on_tables_changed(app, listener):
+    app.extensions.setdefault('table_change_listeners', []).append(listener)
+
+def mark_changed(*tables):
+    db.session.info.setdefault('changed_tables', set()).update(tables)
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changed_tables(session, flush_context):
+    tables = session.info.setdefault('changed_tables', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tables.add(obj.__tablename__)
+
+@event.listens_for(db.session, 'after_commit')
+def notify_changed_tables(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        for listener in session.app.extensions.get('table_change_listeners', ()):
+            listener(*tables)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+'''
+bulk_insert(model, rows) / bulk_update(model, rows) / bulk_delete(model, ids)
+    write a whole batch of plain dicts with executemany-style statements in a
+    single transaction, instead of one commit per row.
+    bulk_insert returns the new ids in the order of `rows`.
+'''
+def bulk_insert(model, rows):
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            statement = model.__table__.insert().values(rows).returning(model.id)
+            ids = [row[0] for row in db.session.execute(statement)]
+        else:
+            db.session.bulk_insert_mappings(model, rows, return_defaults=True)
+            ids = [row['id'] for row in rows]
+        mark_changed(model.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return ids
+
+def bulk_update(model, rows):
+    try:
+        db.session.bulk_update_mappings(model, rows)
+        mark_changed(model.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+def bulk_delete(model, ids):
+    try:
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        mark_changed(model.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+'''
+casting
+    which actors are cast in which movies
+'''
+casting = db.Table('casting',
+    db.Column('movie_id', db.Integer,
+              db.ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('actor_id', db.Integer,
+              db.ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True,
+              index=True)
+)
 
 class Movie(db.Model):
     __tablename__= 'movies'
@@ -27,6 +140,9 @@ class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
     release = db.Column(db.String)
+    actors = db.relationship('Actor', secondary=casting,
+                             backref=db.backref('movies', order_by='Movie.id'),
+                             order_by='Actor.id')
 
     def __repr__(self):
         return f"<Movie id='{self.id}' title='{self.title}'>"
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+
+'''
+InstrumentedQueuePool
+    QueuePool that reports how long each checkout waited for a connection
+    to the PoolMetrics attached to it. _do_get is where every checkout
+    takes a connection from the queue (or opens an overflow one).
+'''
+class InstrumentedQueuePool(QueuePool):
+    metrics = None
+
+    def _do_get(self):
+        if self.metrics is None:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.metrics.record_timeout(time.perf_counter() - start)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+'''
+PoolMetrics
+    counts pool activity through SQLAlchemy pool events: connections opened,
+    checkouts/checkins, invalidations, time spent waiting for a connection
+    and checkout timeouts. waits longer than `slow_wait` seconds are logged.
+'''
+class PoolMetrics:
+    def __init__(self, slow_wait=1.0):
+        self.slow_wait = slow_wait
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        self.engine = engine
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.metrics = self
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+        return self
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+        if seconds >= self.slow_wait:
+            logger.warning('waited %.3fs for a database connection (%s)',
+                           seconds, self.engine.pool.status())
+
+    def record_timeout(self, seconds):
+        with self._lock:
+            self.timeouts += 1
+        logger.error('timed out after %.3fs waiting for a database connection (%s)',
+                     seconds, self.engine.pool.status())
+
+    def stats(self):
+        pool = self.engine.pool
+        stats = {
+            'pool': type(pool).__name__,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'invalidations': self.invalidations,
+            'timeouts': self.timeouts,
+            'waits': self.waits,
+            'wait_total': round(self.wait_total, 6),
+            'wait_max': round(self.wait_max, 6)
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(pool.overflow(), 0)
+            })
+        else:
+            stats['checked_out'] = self.checkouts - self.checkins
+        return stats
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+
+
+'''
+CacheBackend
+    storage interface for ResponseCache. entries are stored with a set of
+    tags (table names) so that every entry depending on a table can be
+    dropped with invalidate(tag).
+'''
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, tags):
+        raise NotImplementedError
+
+    def invalidate(self, tag):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+'''
+LRUBackend
+    in-process CacheBackend holding at most `max_size` entries
+'''
+class LRUBackend(CacheBackend):
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, tags):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.pop(tag, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[1]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+'''
+ResponseCache
+    caches successful json responses of read endpoints. the key is the
+    request path, its query args and the caller's permissions, so callers
+    with different scopes never share an entry. every response carries an
+    ETag and a matching If-None-Match is answered with a 304.
+'''
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUBackend()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(payload):
+        args = sorted(request.args.items(multi=True))
+        scope = sorted(payload.get('permissions', []))
+        raw = '|'.join([request.path, repr(args), repr(scope)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def cached(self, *tags):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(payload, *args, **kwargs):
+                key = self.make_key(payload)
+                entry = self.backend.get(key)
+                if entry is None:
+                    self.misses += 1
+                    response = current_app.make_response(f(payload, *args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    entry = (body, hashlib.md5(body).hexdigest())
+                    self.backend.set(key, entry, tags)
+                else:
+                    self.hits += 1
+                    response = current_app.response_class(
+                        entry[0], mimetype='application/json')
+
+                response.set_etag(entry[1])
+                return response.make_conditional(request)
+            return wrapper
+        return cached_decorator
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.invalidate(tag)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
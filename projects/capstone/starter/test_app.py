@@ -1,9 +1,20 @@
 import os
 import unittest
 import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, create_engine
+from sqlalchemy.exc import TimeoutError
 from app import create_app
 from models import *
+from jwks import JWKSCache
+from token_cache import TokenCache
+from response_cache import ResponseCache, LRUBackend
+from pool_metrics import PoolMetrics, InstrumentedQueuePool
+from instrumentation import Instrumentation, Histogram, timed
 
 class AgencyTestCase(unittest.TestCase):
 
@@ -50,6 +61,42 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'],'Authorization header is expected.')
+
+    def test_internal_db_pool_disabled_by_default404(self):
+
+        res = self.client().get('/internal/db-pool')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_metrics_disabled_by_default404(self):
+
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_actors_cursor_paginated(self):
+
+        res = self.client().get('/actors?per_page=1&count=false', headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+        self.assertIsNone(data['total_actors'])
+
+        res = self.client().get('/actors?per_page=1&cursor=' + data['next_cursor'], headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_page['actors'][0]['id'], data['actors'][0]['id'])
+
+    def test_get_actors_invalid_cursor400(self):
+
+        res = self.client().get('/actors?cursor=invalid!', headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'],'bad request')
     
 
     
@@ -202,6 +249,83 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'],'Permission not found.')
 
+    def test_export_actors(self):
+
+        res = self.client().get('/actors/export', headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        for line in lines:
+            self.assertIn('id', json.loads(line))
+
+    def test_export_actors_without_autherization401(self):
+
+        res = self.client().get('/actors/export')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'],'Authorization header is expected.')
+
+    def test_create_actors_bulk(self):
+
+        json_actors = [
+            {'name': 'Keanu Reaves', 'age': 58, 'gender': 'male'},
+            {'name': 'Carrie-Anne Moss', 'age': 55, 'gender': 'female'}
+        ]
+
+        res = self.client().post('/actors/bulk',json = json_actors, headers={'Authorization': 'Bearer ' + Casting_Director_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(data['results'][0]['status'], 'created')
+
+    def test_create_actors_bulk422(self):
+
+        json_actors = [
+            {'name': 'Keanu Reaves', 'age': 58, 'gender': 'male'},
+            {'name': 'Carrie-Anne Moss', 'age': 55}
+        ]
+
+        res = self.client().post('/actors/bulk',json = json_actors, headers={'Authorization': 'Bearer ' + Casting_Director_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['index'], 1)
+
+    def test_update_actors_bulk404_item(self):
+
+        json_actors = [{'id': 1000, 'age': 59}]
+
+        res = self.client().patch('/actors/bulk',json = json_actors, headers={'Authorization': 'Bearer ' + Casting_Director_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['message'], 'resource not found')
+
+    def test_delete_actors_bulk422_boolean_id(self):
+
+        res = self.client().delete('/actors/bulk',json = [True], headers={'Authorization': 'Bearer ' + Casting_Director_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['message'], 'item must be an integer id')
+
+    def test_delete_actors_bulk_without_permission403(self):
+
+        res = self.client().delete('/actors/bulk',json = [1], headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'],'Permission not found.')
+
 
     """Movies Test"""
 
@@ -235,6 +359,58 @@ class AgencyTestCase(unittest.TestCase):
     
 
     
+    def count_queries(self, path, token):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path, headers={'Authorization': 'Bearer ' + token})
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return res, len(statements)
+
+    def test_get_movies_include_actors_fixed_query_count(self):
+
+        for per_page in (1, 10, 100):
+            res, queries = self.count_queries('/movies?include=actors&per_page={}'.format(per_page), Executive_Producer_token)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('actors', data['movies'][0])
+            # page, selectin load of the actors, total count
+            self.assertEqual(queries, 3)
+
+    def test_get_movie_actors404(self):
+
+        res = self.client().get('/movies/1000/actors', headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'],'resource not found')
+
+    def test_cast_actors422_non_integer_ids(self):
+
+        res = self.client().post('/movies/1/actors',json = {'actors': [{'id': 1}]}, headers={'Authorization': 'Bearer ' + Executive_Producer_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_cast_actors_without_permission403(self):
+
+        res = self.client().post('/movies/1/actors',json = {'actors': [1]}, headers={'Authorization': 'Bearer ' + Casting_Assistant_Token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'],'Permission not found.')
+
     def test_create_new_movie(self):
         
         json_movie = {
@@ -380,6 +556,286 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'],'Permission not found.')
 
+class FakeJWKSHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.hits += 1
+        time.sleep(server.delay)
+        if server.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({'keys': server.keys}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeJWKSHandler)
+        self.server.hits = 0
+        self.server.fail = False
+        self.server.delay = 0
+        self.server.keys = [{'kid': 'a', 'kty': 'RSA', 'use': 'sig',
+                             'n': 'n', 'e': 'AQAB'}]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.now = 0
+        self.cache = JWKSCache(
+            'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+                self.server.server_port),
+            ttl=100, refresh_ahead=10, min_refetch_interval=5,
+            clock=lambda: self.now)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_jwks_keys_are_cached(self):
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.server.hits, 1)
+
+    def test_jwks_refreshes_in_background_before_expiry(self):
+        self.cache.get_key('a')
+        self.server.keys.append({'kid': 'b', 'kty': 'RSA', 'use': 'sig',
+                                 'n': 'n', 'e': 'AQAB'})
+        self.now = 95
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.cache._refresh_thread.join()
+        self.assertEqual(self.server.hits, 2)
+        self.assertEqual(self.cache.get_key('b')['kid'], 'b')
+        self.assertEqual(self.server.hits, 2)
+
+    def test_jwks_unknown_kid_refetch_is_rate_limited(self):
+        self.cache.get_key('a')
+        self.now = 10
+        self.assertIsNone(self.cache.get_key('x'))
+        self.assertIsNone(self.cache.get_key('x'))
+        self.assertEqual(self.server.hits, 2)
+        self.now = 20
+        self.assertIsNone(self.cache.get_key('x'))
+        self.assertEqual(self.server.hits, 3)
+
+    def test_jwks_failed_background_refresh_is_not_retried_every_request(self):
+        self.cache.get_key('a')
+        self.server.fail = True
+        self.now = 95
+        self.cache.get_key('a')
+        self.cache._refresh_thread.join()
+        self.now = 96
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertFalse(self.cache._refresh_thread.is_alive())
+        self.assertEqual(self.server.hits, 2)
+        self.now = 101
+        self.cache.get_key('a')
+        self.assertEqual(self.server.hits, 3)
+
+    def test_jwks_concurrent_unknown_kid_lookups_fetch_once(self):
+        self.cache.get_key('a')
+        self.server.delay = 0.2
+        self.now = 10
+        threads = [threading.Thread(target=self.cache.get_key, args=('x',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.hits, 2)
+
+    def test_jwks_serves_stale_keys_when_refetch_fails(self):
+        self.cache.get_key('a')
+        self.server.fail = True
+        self.now = 500
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.server.hits, 2)
+
+    def test_jwks_raises_without_any_keys(self):
+        self.server.fail = True
+        with self.assertRaises(LookupError):
+            self.cache.get_key('a')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.cache = TokenCache(max_size=2, clock=lambda: self.now)
+        self.payload = {'exp': 2000, 'permissions': ['get:actors']}
+
+    def test_token_cache_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', self.payload)
+        self.assertEqual(self.cache.get('token'), self.payload)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_token_cache_expires_at_exp_claim(self):
+        self.cache.put('token', self.payload)
+        self.now = 2000
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_token_cache_evicts_least_recently_used(self):
+        self.cache.put('a', self.payload)
+        self.cache.put('b', self.payload)
+        self.cache.get('a')
+        self.cache.put('c', self.payload)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_token_cache_skips_payload_without_exp(self):
+        self.cache.put('token', {'permissions': []})
+        self.assertIsNone(self.cache.get('token'))
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.cache = ResponseCache(LRUBackend(max_size=2))
+        app = Flask(__name__)
+
+        def fake_auth(f):
+            def wrapper():
+                return f({'permissions': ['get:actors']})
+            return wrapper
+
+        @app.route('/actors')
+        @fake_auth
+        @self.cache.cached('actors')
+        def get_actors(payload):
+            self.calls += 1
+            return jsonify({'success': True, 'calls': self.calls})
+
+        self.client = app.test_client()
+
+    def test_response_cache_hit(self):
+        first = self.client.get('/actors')
+        second = self.client.get('/actors')
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_response_cache_key_includes_query_args(self):
+        self.client.get('/actors?page=1')
+        self.client.get('/actors?page=2')
+
+        self.assertEqual(self.calls, 2)
+
+    def test_response_cache_invalidate(self):
+        self.client.get('/actors')
+        self.cache.invalidate('actors')
+        res = self.client.get('/actors')
+
+        self.assertEqual(json.loads(res.data)['calls'], 2)
+
+    def test_response_cache_etag_not_modified304(self):
+        res = self.client.get('/actors')
+        res = self.client.get('/actors', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_lru_backend_evicts_and_drops_tags(self):
+        backend = LRUBackend(max_size=2)
+        backend.set('a', 1, ('actors',))
+        backend.set('b', 2, ('movies',))
+        backend.get('a')
+        backend.set('c', 3, ('actors',))
+
+        self.assertIsNone(backend.get('b'))
+        backend.invalidate('actors')
+        self.assertEqual(len(backend), 0)
+
+
+class PoolMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.1)
+        self.metrics = PoolMetrics().attach(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_pool_metrics_checkout_and_checkin(self):
+        connection = self.engine.connect()
+        stats = self.metrics.stats()
+
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+
+        connection.close()
+        stats = self.metrics.stats()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['checkins'], 1)
+
+    def test_pool_metrics_timeout(self):
+        connection = self.engine.connect()
+        with self.assertRaises(TimeoutError):
+            self.engine.connect()
+        connection.close()
+
+        self.assertEqual(self.metrics.stats()['timeouts'], 1)
+
+    def test_pool_metrics_survive_dispose(self):
+        self.engine.dispose()
+        self.engine.connect().close()
+
+        self.assertEqual(self.metrics.stats()['waits'], 1)
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        self.instrumentation = Instrumentation(app)
+
+        @app.route('/actors/<int:actor_id>')
+        def get_actor(actor_id):
+            with timed('auth'):
+                pass
+            return jsonify({'success': True, 'id': actor_id})
+
+        self.client = app.test_client()
+
+    def test_metrics_latency_per_route(self):
+        self.client.get('/actors/1')
+        self.client.get('/actors/2')
+        res = self.client.get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/actors/<int:actor_id>",status="200"} 2', body)
+        self.assertIn('http_request_phase_duration_seconds_count{route="/actors/<int:actor_id>",phase="auth"} 2', body)
+        self.assertIn('http_request_phase_duration_seconds_count{route="/actors/<int:actor_id>",phase="serialize"} 2', body)
+
+    def test_metrics_route_not_registered_without_path(self):
+        app = Flask(__name__)
+        Instrumentation(app, path=None)
+
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency', 'test', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(('/',), 0.05)
+        histogram.observe(('/',), 0.5)
+        lines = histogram.expose()
+
+        self.assertIn('latency_bucket{route="/",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{route="/",le="1.0"} 2', lines)
+        self.assertIn('latency_bucket{route="/",le="+Inf"} 2', lines)
+        self.assertIn('latency_count{route="/"} 2', lines)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()